@@ -1,7 +1,14 @@
 # QR Code Error Correction Code Generation Module: Generate error correction codes using Reed-Solomon algorithm
 
-from constant import ecc_num_per_block, lindex
-from reedsolo import RSCodec
+from itertools import groupby
+from constant import ecc_num_per_block, lindex, po2, log
+from lazyimport import optional_module
+
+# Optional: enables the batched encoder for blocks of the same length, imported on first use
+np = optional_module('numpy')
+
+# Generator polynomial multiplication tables per ECC length, built on first use: {ecc_num: [table, numpy table]}
+_generator_cache = {}
 
 def encode(ver, ecl, data_codewords):
     """
@@ -16,26 +23,91 @@ def encode(ver, ecl, data_codewords):
     # Get the number of error correction codewords needed per block
     ecc_num = ecc_num_per_block[ver-1][lindex[ecl]]
     
-    # Initialize Reed-Solomon encoder
-    rs = RSCodec(ecc_num)
-    
-    # Generate corresponding error correction codes for each data block
+    # Blocks of the same length (one group of grouping_list) are encoded together
     ecc = []
-    for dc in data_codewords:
-        # Convert data block to bytes array
-        data_bytes = bytes(dc)
-        
-        # Encode and get error correction part
-        encoded = rs.encode(data_bytes)
-        
-        # Only take the error correction part (remove the original data part)
-        ecc_bytes = encoded[-ecc_num:]
-        
-        # Convert to integer list and add to result
-        ecc.append(list(ecc_bytes))
+    for _, blocks in groupby(data_codewords, key=len):
+        ecc += encode_blocks(list(blocks), ecc_num)
     
     return ecc
 
+def encode_blocks(blocks, ecc_num):
+    """
+    Generate error correction codewords for data blocks of the same length
+    Args:
+        blocks: List of data blocks, all with the same number of codewords
+        ecc_num: Number of error correction codewords per block
+    Returns:
+        List of error correction codewords, one list per block
+    """
+    batched = np is not None and len(blocks) > 1
+    table, table_np = get_generator_table(ecc_num, batched)
+    
+    # Batched path: divide all blocks by the generator polynomial in one pass
+    if batched:
+        data = np.array(blocks, dtype=np.uint8)
+        rem = np.zeros((len(blocks), ecc_num), dtype=np.uint8)
+        for column in range(data.shape[1]):
+            factor = data[:, column] ^ rem[:, 0]
+            rem[:, :-1] = rem[:, 1:]
+            rem[:, -1] = 0
+            rem ^= table_np[factor]
+        return rem.tolist()
+    
+    ecc = []
+    for dc in blocks:
+        # Polynomial division by the generator, the remainder is the error correction part
+        rem = [0] * ecc_num
+        for c in dc:
+            factor = c ^ rem[0]
+            rem = rem[1:] + [0]
+            if factor:
+                rem = [r ^ t for r, t in zip(rem, table[factor])]
+        ecc.append(rem)
+    return ecc
+
+def get_generator_table(ecc_num, numpy_table=False):
+    """
+    Get the multiplication table of the generator polynomial for an ECC length, built once and cached
+    Args:
+        ecc_num: Number of error correction codewords (degree of the generator polynomial)
+        numpy_table: Whether the NumPy copy of the table is needed, it is built (and NumPy loaded) on first request
+    Returns:
+        (table, numpy table): table[f] is the generator polynomial without its leading term multiplied by f,
+                              numpy table is the same as a (256, ecc_num) uint8 array, None until requested or without NumPy
+    """
+    entry = _generator_cache.get(ecc_num)
+    if entry is None:
+        generator = get_generator(ecc_num)[1:]
+        entry = _generator_cache[ecc_num] = [[[gf_mul(f, g) for g in generator] for f in range(256)], None]
+    if numpy_table and entry[1] is None and np is not None:
+        entry[1] = np.array(entry[0], dtype=np.uint8)
+    return entry[0], entry[1]
+
+def get_generator(ecc_num):
+    """
+    Calculate the generator polynomial (x - α^0)(x - α^1)...(x - α^(ecc_num-1))
+    Args:
+        ecc_num: Number of error correction codewords
+    Returns:
+        Coefficients from the highest degree term down
+    """
+    generator = [1]
+    for i in range(ecc_num):
+        # Multiply by (x + α^i), addition and subtraction are both XOR in GF(256)
+        product = generator + [0]
+        for j, g in enumerate(generator):
+            product[j+1] ^= gf_mul(g, po2[i])
+        generator = product
+    return generator
+
+def gf_mul(a, b):
+    """
+    Multiply two elements of GF(256) using the log/antilog tables in constant.py
+    """
+    if a == 0 or b == 0:
+        return 0
+    return po2[(log[a] + log[b]) % 255]
+
 # Code for testing
 if __name__ == '__main__':
     # Example: Version 1, M level error correction, containing one data block
@@ -1,8 +1,17 @@
-from flask import Flask, render_template, request, jsonify, send_file, url_for
+from flask import Flask, render_template, request, jsonify, send_file, url_for, Response, stream_with_context, g
 import os
-import time
+import io
+import csv
+import zipfile
 import theqrmodule # Import custom QR code generation module
+from theqrmodule import parse_options
+import vector
+import verifier
 import base64
+import logging
+import metrics
+from cache import LRUCache, DiskCache
+from workqueue import WorkQueue, QueueFull
 
 app = Flask(__name__) # Create Flask application instance
 
@@ -12,6 +21,103 @@ GENERATED_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sta
 # Ensure the generated folder exists
 os.makedirs(GENERATED_FOLDER, exist_ok=True)
 
+# Whether /generate keeps a copy of each image in GENERATED_FOLDER for the download link
+PERSIST_GENERATED = os.environ.get('QR_PERSIST_GENERATED', '1') != '0'
+
+# On-disk cache of the images behind the download links, named after a hash of the generation parameters:
+# budget in bytes and seconds a file is kept (least recently used files and expired files are removed)
+DISK_CACHE_MAX_BYTES = int(os.environ.get('QR_DISK_CACHE_BYTES', 256 * 1024 * 1024))
+DISK_CACHE_TTL = int(os.environ.get('QR_DISK_CACHE_TTL', 7 * 24 * 3600))
+disk_cache = DiskCache(GENERATED_FOLDER, DISK_CACHE_MAX_BYTES, DISK_CACHE_TTL)
+
+# Browsers and proxies may keep downloads for a year: a download URL always holds the same image
+DOWNLOAD_MAX_AGE = 365 * 24 * 3600
+
+# Let the front web server send download files itself (X-Sendfile), off by default
+app.config['USE_X_SENDFILE'] = os.environ.get('QR_X_SENDFILE', '0') == '1'
+
+# Maximum number of QR codes in one batch request
+BATCH_MAX_ITEMS = 50000
+
+# In-process cache of generated images for repeated identical requests, budget in bytes (0 disables it)
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('QR_RESULT_CACHE_BYTES', 32 * 1024 * 1024))
+result_cache = LRUCache(RESULT_CACHE_MAX_BYTES)
+
+# Bounded queue for QR code generation: worker processes (QR_WORKERS, 0 runs jobs in the request thread)
+# and a limit of pending jobs (QR_MAX_PENDING), requests beyond it get 503 with Retry-After
+work_queue = WorkQueue()
+
+# Log level of the application modules (e.g. DEBUG for the sampled per-request diagnostics of data.py)
+logging.basicConfig(level=os.environ.get('QR_LOG_LEVEL', 'WARNING').upper())
+
+# HTTP request metrics for /metrics, labeled by route function name
+http_requests = metrics.Counter('qr_http_requests_total', 'HTTP requests served', ('endpoint', 'method', 'status'))
+http_errors = metrics.Counter('qr_http_errors_total', 'HTTP requests answered with a server error (5xx)', ('endpoint',))
+http_in_flight = metrics.Gauge('qr_http_requests_in_flight', 'HTTP requests being served, including streaming responses', ('endpoint',))
+
+# Result cache statistics, read when /metrics is requested
+for _name, _kind, _help in (
+    ('hits', 'counter', 'Result cache hits'),
+    ('misses', 'counter', 'Result cache misses'),
+    ('evictions', 'counter', 'Result cache evictions'),
+    ('items', 'gauge', 'Images in the result cache'),
+    ('bytes', 'gauge', 'Bytes used by the result cache')
+):
+    metrics.Collector(
+        f'qr_result_cache_{_name}' + ('_total' if _kind == 'counter' else ''), _help, (),
+        lambda name=_name: [({}, result_cache.stats()[name])], _kind
+    )
+
+# Disk cache statistics
+for _name, _kind, _help in (
+    ('hits', 'counter', 'Disk cache hits'),
+    ('misses', 'counter', 'Disk cache misses'),
+    ('evictions', 'counter', 'Disk cache files removed to stay within the budget'),
+    ('expirations', 'counter', 'Disk cache files removed after their time to live'),
+    ('items', 'gauge', 'Files in the disk cache'),
+    ('bytes', 'gauge', 'Bytes used by the disk cache')
+):
+    metrics.Collector(
+        f'qr_disk_cache_{_name}' + ('_total' if _kind == 'counter' else ''), _help, (),
+        lambda name=_name: [({}, disk_cache.stats()[name])], _kind
+    )
+
+# Work queue state
+metrics.Collector('qr_work_queue_pending', 'Generation jobs running or waiting', (), lambda: [({}, work_queue.pending)])
+metrics.Collector('qr_work_queue_rejected_total', 'Generation jobs rejected because the queue was full', (),
+                  lambda: [({}, work_queue.rejected)], 'counter')
+
+def busy_response(error):
+    """
+    Response for a request rejected by the full work queue
+    error: QueueFull exception
+    """
+    response = jsonify({'success': False, 'error': str(error)})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+@app.before_request
+def _start_request_metrics():
+    """Count the request as in flight until its teardown"""
+    g.metrics_endpoint = request.endpoint or 'unknown'
+    http_in_flight.inc(endpoint=g.metrics_endpoint)
+
+@app.after_request
+def _count_request(response):
+    """Count the response by status code, server errors also as errors"""
+    endpoint = g.get('metrics_endpoint', 'unknown')
+    http_requests.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    if response.status_code >= 500:
+        http_errors.inc(endpoint=endpoint)
+    return response
+
+@app.teardown_request
+def _finish_request_metrics(exc):
+    """Streaming responses are torn down when the stream ends, so they stay in flight while streaming"""
+    if 'metrics_endpoint' in g:
+        http_in_flight.dec(endpoint=g.metrics_endpoint)
+
 # Website entry point, renders index.html template when accessing the root URL
 @app.route('/')
 def index():
@@ -30,118 +136,232 @@ def generate_qrcode():
         if not content:
             return jsonify({'success': False, 'error': 'Please enter content'}), 400
         
-        # Get error correction level
-        ecl = request.form.get('ecl', 'L') # Default is L level
-        if ecl not in ['L', 'M', 'Q', 'H']:
-            ecl = 'L' 
-        
-        # Get version number, if not specified or invalid, version is automatically selected
-        try:
-            version = int(request.form.get('version', '0')) # 0 means auto-select version
-            if version < 0 or version > 40: # Version range 1-40, 0 means auto
-                version = 0 
-        except ValueError:
-            version = 0 
-        
-        # Get custom appearance parameters
-        foreground_color = request.form.get('foreground_color', 'black') # Foreground color
-        background_color = request.form.get('background_color', 'white') # Background color
-        module_shape = request.form.get('module_shape', 'square') # Module shape
-        if module_shape not in ['square', 'circle', 'diamond']:
-            module_shape = 'square' # Default is square
-            
-        # Get custom size and border parameters
-        try:
-            unit_size = int(request.form.get('unit_size', '3')) # Pixel size of each module
-            if unit_size < 1 or unit_size > 10:
-                unit_size = 3 
-        except ValueError:
-            unit_size = 3
-            
-        try:
-            border_size = int(request.form.get('border_size', '4')) # Border size (space from QR code to image edge)
-            if border_size < 0 or border_size > 10: # In draw.py this is actually quiet_zone
-                border_size = 4 
-        except ValueError:
-            border_size = 4
-            
-        try:
-            margin = int(request.form.get('margin', '4')) # Internal margin when drawing QR code
-            if margin < 0 or margin > 10:
-                margin = 4 
-        except ValueError:
-            margin = 4
-        
-        # Get whether to add extra frame (at drawing level)
-        frame = request.form.get('frame', 'true').lower() == 'true'
+        # Get error correction level, version and custom appearance parameters
+        version, ecl, options = parse_options(request.form)
         
-        # Get image filter
-        filter_name = request.form.get('filter_name', 'none') # Image filter name
-        if filter_name not in ['none', 'blur', 'edge_enhance', 'smooth']:
-            filter_name = 'none' # Default is no filter
+        # Identical requests (after normalizing the parameters) are answered from the result cache
+        key = theqrmodule.cache_key(version, ecl, content, **options)
+        cached = result_cache.get(key)
+        if cached is None:
+            # Call QR code generation module, passing custom parameters, the image is rendered in memory
+            # Generation runs in the bounded work queue, a full queue raises QueueFull
+            ver, image = work_queue.run(
+                theqrmodule.get_qrcode_bytes,
+                version, 
+                ecl, 
+                content, 
+                **options
+            )
+            result_cache.put(key, (ver, image), len(image))
+        else:
+            ver, image = cached
         
-        # Generate unique filename
-        timestamp = int(time.time())
-        filename = f"qrcode_{timestamp}.png"
-        # save_path = os.path.join(GENERATED_FOLDER, filename) # save_path is handled in theqrmodule
+        # Convert to base64 for direct display on the webpage
+        image_base64 = f"data:image/png;base64,{base64.b64encode(image).decode('utf-8')}"
         
-        # Call QR code generation module, passing custom parameters
-        ver, qrcode_path = theqrmodule.get_qrcode(
-            version, 
-            ecl, 
-            content, 
-            GENERATED_FOLDER, # Pass the save folder path
-            foreground_color=foreground_color,
-            background_color=background_color,
-            module_shape=module_shape,
-            unit_size=unit_size,
-            border_size=border_size, # This border_size corresponds to quiet_zone in draw.py
-            margin=margin,           # This margin corresponds to margin in draw.py
-            frame=frame,
-            filter_name=filter_name
-        )
-        
-        # Read the generated image and convert to base64 for direct display on the webpage
-        with open(qrcode_path, "rb") as image_file:
-            encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
+        # Image download URL: a disk cache file named after the parameters, or the image itself when nothing is persisted
+        name = disk_cache.put(key, image) if PERSIST_GENERATED else None
+        image_url = url_for('download_file', filename=name) if name else image_base64
         
         # Return results
         return jsonify({
             'success': True, 
             'version': ver, # Return the actual version used
-            'image_base64': f"data:image/png;base64,{encoded_string}", # Base64 encoded image data
-            'image_url': url_for('static', filename=f'generated/{os.path.basename(qrcode_path)}') # Image download URL
+            'image_base64': image_base64, # Base64 encoded image data
+            'image_url': image_url # Image download URL
         })
     
+    except QueueFull as e:
+        # Too many pending generation jobs, the client should retry later
+        return busy_response(e)
+    
     except Exception as e:
         # Catch exceptions and return error message
         return jsonify({'success': False, 'error': str(e)}), 500
 
+# Vector QR code endpoint, streams an SVG or PDF document for printing at any size
+@app.route('/generate/vector', methods=['POST'])
+def generate_vector():
+    """
+    API endpoint: Generate QR code as a vector document
+    Form fields are the same as for /generate, plus 'format' ('svg' or 'pdf', default 'svg').
+    unit_size only sets the nominal size of a module (pixels for SVG, points for PDF), the drawing scales freely.
+    """
+    try:
+        # Get form data
+        content = request.form.get('content', '') # QR code content
+        if not content:
+            return jsonify({'success': False, 'error': 'Please enter content'}), 400
+        
+        format = request.form.get('format', 'svg')
+        if format not in vector.formats:
+            return jsonify({'success': False, 'error': 'Format must be svg or pdf'}), 400
+        mimetype, extension = vector.formats[format]
+        
+        # Get error correction level, version and custom appearance parameters
+        version, ecl, options = parse_options(request.form)
+        
+        # Encoding errors are raised here, the document itself is streamed as it is written
+        ver, qrmatrix = work_queue.run(theqrmodule.make_qrmatrix, version, ecl, content)
+        document = vector.vector_qrcode(qrmatrix, format, **options)
+        response = Response(stream_with_context(document), mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename=qrcode.{extension}'
+        response.headers['X-QR-Version'] = str(ver)
+        return response
+    
+    except QueueFull as e:
+        # Too many pending generation jobs, the client should retry later
+        return busy_response(e)
+    
+    except Exception as e:
+        # Catch exceptions and return error message
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+# Batch generation API endpoint, streams a ZIP archive of QR codes
+@app.route('/generate/batch', methods=['POST'])
+def generate_batch():
+    """
+    API endpoint: Generate many QR codes and stream them back as a ZIP archive
+    
+    Accepted input:
+    - JSON array of items, or a JSON object {"items": [...], "options": {...}}
+      each item is a content string or an object with 'content' and its own options
+    - CSV file upload (form field 'file') with a header row containing 'content',
+      other columns are per-row options, form fields are shared options
+    Per-row options override shared options. Options are the same as for /generate.
+    
+    The archive holds one PNG per row and manifest.csv (row, filename, version, content, error).
+    Rows that fail are listed in the manifest with their error instead of aborting the batch.
+    A sample of the rows (QR_VERIFY_SAMPLE_RATE) is decoded again, rows that do not match their content fail.
+    """
+    try:
+        if request.is_json:
+            payload = request.get_json()
+            if isinstance(payload, list):
+                payload = {'items': payload}
+            if not isinstance(payload, dict) or not isinstance(payload.get('items'), list):
+                return jsonify({'success': False, 'error': 'Expected a JSON array of items'}), 400
+            shared = payload.get('options') or {}
+            rows = ({'content': i} if isinstance(i, str) else i for i in payload['items'])
+        elif 'file' in request.files:
+            shared = request.form.to_dict()
+            rows = csv.DictReader(io.TextIOWrapper(request.files['file'].stream, encoding='utf-8-sig'))
+            if 'content' not in (rows.fieldnames or []):
+                return jsonify({'success': False, 'error': 'CSV needs a header row with a content column'}), 400
+        else:
+            return jsonify({'success': False, 'error': 'Send a JSON array or upload a CSV file'}), 400
+        
+        response = Response(stream_with_context(_stream_batch_zip(rows, shared)), mimetype='application/zip')
+        response.headers['Content-Disposition'] = 'attachment; filename=qrcodes.zip'
+        return response
+    
+    except Exception as e:
+        # Catch exceptions and return error message
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+class _ZipStream:
+    """
+    Write-only, unseekable file object collecting the bytes written by zipfile
+    """
+    def __init__(self):
+        self.chunks = []
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def pop(self):
+        """Return and clear the bytes written so far"""
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def _stream_batch_zip(rows, shared):
+    """
+    Generate the QR codes of a batch one by one and yield the ZIP archive in chunks
+    rows: Iterable of dicts with 'content' and per-row options
+    shared: Options used when a row does not set them
+    """
+    stream = _ZipStream()
+    manifest = io.StringIO()
+    writer = csv.writer(manifest)
+    writer.writerow(['row', 'filename', 'version', 'content', 'error'])
+    
+    # Images are rendered in memory and written straight into the archive
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_STORED) as archive:
+        for index, row in enumerate(rows):
+            if index >= BATCH_MAX_ITEMS:
+                writer.writerow([index, '', '', '', f'Batch limit of {BATCH_MAX_ITEMS} items reached'])
+                break
+            filename = f'qrcode_{index:05d}.png'
+            content = ''
+            try:
+                if not isinstance(row, dict):
+                    raise ValueError('Item must be a string or an object')
+                # Empty per-row values (e.g. empty CSV cells) fall back to the shared options
+                values = {**shared, **{k: v for k, v in row.items() if v not in ('', None)}}
+                content = str(values.get('content', ''))
+                if not content:
+                    raise ValueError('Please enter content')
+                version, ecl, options = parse_options(values)
+                # Batch rows wait for room in the work queue instead of failing, a sample of them is decoded again
+                ver, image = work_queue.run(theqrmodule.get_qrcode_bytes, version, ecl, content, wait=True,
+                                            verify=verifier.should_verify(), **options)
+                archive.writestr(filename, image)
+                writer.writerow([index, filename, ver, content, ''])
+            except Exception as e:
+                writer.writerow([index, '', '', content, str(e)])
+            
+            # Send what has been written so far, only the current image is held in memory
+            yield stream.pop()
+        
+        archive.writestr('manifest.csv', manifest.getvalue())
+    yield stream.pop()
+
+# Prometheus metrics: per-stage generation latency, HTTP requests, errors, in-flight requests and result cache
+@app.route('/metrics')
+def metrics_endpoint():
+    """API endpoint: All metrics in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Result cache statistics for monitoring
+@app.route('/cache/stats')
+def cache_stats():
+    """API endpoint: Hit, miss and eviction counters of the result cache and the disk cache"""
+    return jsonify({**result_cache.stats(), 'disk': disk_cache.stats()})
+
 # API endpoint to get QR code creation steps
 @app.route('/get_qr_steps', methods=['POST'])
 def get_qr_steps():
-    """API endpoint: Get QR code creation steps"""
+    """
+    API endpoint: Get QR code creation steps
+    Form field 'format': 'png' (default) returns one base64 PNG per step,
+    'delta' returns the compact payload of theqrmodule.get_qr_steps_delta
+    """
     try:
         # Get form data
         content = request.form.get('content', '') # QR code content
         if not content:
             return jsonify({'success': False, 'error': 'Please enter content'}), 400
         
-        # Get error correction level
-        ecl = request.form.get('ecl', 'L') # Default is L level
-        if ecl not in ['L', 'M', 'Q', 'H']:
-            ecl = 'L' 
+        # Get error correction level and version
+        version, ecl, _ = parse_options(request.form)
         
-        # Get version number, if not specified or invalid, version is automatically selected
-        try:
-            version = int(request.form.get('version', '0')) # 0 means auto-select version
-            if version < 0 or version > 40:
-                version = 0
-        except ValueError:
-            version = 0
+        # Compact format: first step as a bitset, later steps as changed runs, painted by the browser
+        if request.form.get('format') == 'delta':
+            payload = work_queue.run(theqrmodule.get_qr_steps_delta, version, ecl, content)
+            return jsonify({
+                'success': True,
+                'format': 'delta',
+                'size': payload['size'], # Number of modules per side
+                'steps': payload['steps'] # List containing step descriptions and bitsets or changed runs
+            })
         
         # Call QR code steps generation function
-        steps = theqrmodule.get_qr_steps(version, ecl, content)
+        steps = work_queue.run(theqrmodule.get_qr_steps, version, ecl, content)
         
         # Return results
         return jsonify({
@@ -149,6 +369,10 @@ def get_qr_steps():
             'steps': steps # List containing step descriptions and images
         })
     
+    except QueueFull as e:
+        # Too many pending generation jobs, the client should retry later
+        return busy_response(e)
+    
     except Exception as e:
         # Catch exceptions and return error message
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -156,13 +380,30 @@ def get_qr_steps():
 # API endpoint to download generated QR code image, called when user clicks download button
 @app.route('/download/<filename>')
 def download_file(filename):
-    """Download generated QR code image"""
-    try:
-        # Send file for download
-        return send_file(os.path.join(GENERATED_FOLDER, filename), as_attachment=True)
-    except Exception as e:
-        # If file not found or other error occurs, return 404 or error message
-        return jsonify({'success': False, 'error': str(e)}), 404
+    """
+    Download generated QR code image
+    Files never change under their name, so they have a strong ETag and may be cached for DOWNLOAD_MAX_AGE.
+    A request with a matching If-None-Match is answered with 304 without opening the file.
+    """
+    cached = disk_cache.get(filename)
+    if cached is None:
+        return jsonify({'success': False, 'error': 'File not found or expired, please generate it again'}), 404
+    path, etag = cached
+    
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = DOWNLOAD_MAX_AGE
+    else:
+        try:
+            # The file is handed to the server as a file (wsgi.file_wrapper), not read into memory
+            response = send_file(path, mimetype='image/png', as_attachment=True, etag=etag,
+                                 conditional=True, max_age=DOWNLOAD_MAX_AGE)
+        except FileNotFoundError:
+            return jsonify({'success': False, 'error': 'File not found or expired, please generate it again'}), 404
+    response.cache_control.immutable = True
+    return response
 
 # Application startup configuration
 if __name__ == '__main__':
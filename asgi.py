@@ -0,0 +1,335 @@
+# QR Code ASGI Module: Production serving mode, an async front end for the Flask app with a bounded generation queue
+#
+# Run with any ASGI server, for example:
+#     pip install uvicorn
+#     uvicorn asgi:application --host 0.0.0.0 --port 5002
+#
+# The event loop only reads requests and writes responses. Flask views run in a pool of request threads and
+# hand the CPU-heavy generation to the worker processes of app.work_queue (QR_WORKERS, default one per CPU).
+# When more than QR_MAX_PENDING jobs are pending, requests fail fast with 503 and Retry-After.
+# Requests are also admitted only while a request thread is free (QR_MAX_REQUESTS), and batch requests,
+# which hold their thread for the whole batch, have their own smaller limit (QR_MAX_BATCH_REQUESTS).
+# On shutdown (lifespan event, e.g. SIGTERM to uvicorn) new requests get 503 while pending jobs finish.
+# Request bodies (e.g. batch CSV uploads) are streamed to the view as it reads them, they are never held whole.
+# Files (downloads) are sent by the server itself when it supports the http.response.pathsend extension.
+
+import asyncio
+import io
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# Generation runs in worker processes in this mode, unless configured otherwise
+os.environ.setdefault('QR_WORKERS', str(os.cpu_count() or 1))
+
+import app as flask_app
+import metrics
+
+# Threads running Flask views, they mostly wait for the work queue
+REQUEST_THREADS = int(os.environ.get('QR_REQUEST_THREADS', '32'))
+
+# Requests being served at most, more are answered at once with 503 instead of waiting for a thread
+MAX_REQUESTS = int(os.environ.get('QR_MAX_REQUESTS', REQUEST_THREADS))
+
+# Batch requests being served at most, so that batches never take all request threads
+MAX_BATCH_REQUESTS = int(os.environ.get('QR_MAX_BATCH_REQUESTS', max(1, REQUEST_THREADS // 4)))
+
+# Paths of the requests counted as batch requests
+BATCH_PATHS = ('/generate/batch',)
+
+# Seconds to wait for pending generation jobs on shutdown
+SHUTDOWN_TIMEOUT = float(os.environ.get('QR_SHUTDOWN_TIMEOUT', '30'))
+
+# Response chunks buffered between a request thread and the event loop, a slow client pauses the thread
+STREAM_BUFFER_CHUNKS = 8
+
+logger = logging.getLogger(__name__)
+
+_request_threads = ThreadPoolExecutor(max_workers=REQUEST_THREADS, thread_name_prefix='qr-request')
+_shutting_down = False
+
+rejected_requests = metrics.Counter('qr_rejected_requests_total', 'Requests answered with 503 because all request slots were taken', ('kind',))
+
+# Requests being served, only changed on the event loop
+_in_flight = 0
+_in_flight_batches = 0
+
+async def application(scope, receive, send):
+    """
+    ASGI entry point
+    """
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+    elif scope['type'] == 'http':
+        await _http(scope, receive, send)
+
+async def _lifespan(receive, send):
+    """
+    Startup and graceful shutdown
+    """
+    global _shutting_down
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            # Reject new requests, let pending generation jobs finish, then stop the workers and threads
+            _shutting_down = True
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, flask_app.work_queue.shutdown, SHUTDOWN_TIMEOUT)
+            _request_threads.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def _http(scope, receive, send):
+    """
+    Serve one HTTP request with the Flask app, or answer 503 when it cannot be admitted
+    """
+    global _in_flight, _in_flight_batches
+    retry_after = [(b'retry-after', str(flask_app.work_queue.retry_after).encode())]
+    if _shutting_down:
+        await _send_simple(send, 503, b'{"success": false, "error": "Server is shutting down"}', retry_after)
+        return
+    
+    # Admission: a request that would wait for a request thread is rejected now, so waiting never piles up
+    batch = scope['path'] in BATCH_PATHS
+    if _in_flight >= MAX_REQUESTS or (batch and _in_flight_batches >= MAX_BATCH_REQUESTS):
+        rejected_requests.inc(kind='batch' if batch else 'request')
+        await _send_simple(send, 503, b'{"success": false, "error": "Server is busy, please retry later"}', retry_after)
+        return
+    
+    _in_flight += 1
+    _in_flight_batches += batch
+    try:
+        await _serve(scope, receive, send)
+    finally:
+        _in_flight -= 1
+        _in_flight_batches -= batch
+
+async def _serve(scope, receive, send):
+    """
+    Run the Flask app for one admitted HTTP request
+    """
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue(maxsize=STREAM_BUFFER_CHUNKS)
+    # Request body chunks (data, more to come), read from the client only as fast as the view consumes them
+    body_chunks = asyncio.Queue(maxsize=STREAM_BUFFER_CHUNKS)
+    disconnected = False
+    abandoned = False
+    
+    def put(item):
+        # Called from the request thread, waits while the buffer is full. Nothing is sent once the response is abandoned.
+        if not abandoned:
+            asyncio.run_coroutine_threadsafe(chunks.put(item), loop).result()
+    
+    def run_view():
+        status_headers = []
+        result = None
+        error = None
+    
+        def start_response(status, headers, exc_info=None):
+            status_headers[:] = [status, headers]
+            return lambda data: put(('body', bytes(data)))
+    
+        try:
+            result = flask_app.app(_environ(scope, io.BufferedReader(_RequestBody(loop, body_chunks))), start_response)
+            if isinstance(result, _FileWrapper) and result.path and 'http.response.pathsend' in scope.get('extensions', {}):
+                # Zero copy: the server sends the file, its bytes never pass through Python
+                put(('start', status_headers))
+                put(('pathsend', result.path))
+                return
+            started = False
+            for data in result:
+                if not started:
+                    put(('start', status_headers))
+                    started = True
+                if disconnected:
+                    break
+                if data:
+                    put(('body', bytes(data)))
+            if not started:
+                put(('start', status_headers))
+        except Exception as e:
+            error = e
+        finally:
+            try:
+                if hasattr(result, 'close'):
+                    result.close()
+            except Exception as e:
+                error = error or e
+            # The last chunk: 'error' when the app failed, the response must not look complete
+            put(('error', error) if error is not None else ('end', None))
+    
+    async def receive_body():
+        # The only reader of receive(): passes the request body on to the view, then watches for a disconnect.
+        # The view stops reading the body and writing a streaming response when the client goes away.
+        nonlocal disconnected
+        more = True
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                disconnected = True
+                if more:
+                    await body_chunks.put((b'', False))
+                return
+            if more:
+                more = message.get('more_body', False)
+                await body_chunks.put((message.get('body', b''), more))
+    
+    async def next_chunk():
+        # Next chunk of the view, or an error when the view ended without its last chunk
+        while True:
+            try:
+                return chunks.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+            if view.done():
+                return 'error', view.exception() or RuntimeError('The view ended without a response')
+            get = asyncio.ensure_future(chunks.get())
+            await asyncio.wait({get, view}, return_when=asyncio.FIRST_COMPLETED)
+            if get.done():
+                return get.result()
+            get.cancel()
+    
+    view = loop.run_in_executor(_request_threads, run_view)
+    watcher = asyncio.ensure_future(receive_body())
+    started = False
+    try:
+        while True:
+            kind, value = await next_chunk()
+            if kind == 'start':
+                status, headers = value
+                await send({
+                    'type': 'http.response.start',
+                    'status': int(status.split(' ', 1)[0]),
+                    'headers': [(name.lower().encode('latin-1'), v.encode('latin-1')) for name, v in headers]
+                })
+                started = True
+            elif kind == 'body':
+                await send({'type': 'http.response.body', 'body': value, 'more_body': True})
+            elif kind == 'pathsend':
+                await send({'type': 'http.response.pathsend', 'path': value})
+                break
+            elif kind == 'error':
+                logger.error('Request %s %s failed', scope['method'], scope['path'], exc_info=value)
+                if not started:
+                    await _send_simple(send, 500, b'{"success": false, "error": "Internal server error"}')
+                    break
+                # Part of the response is sent: the error reaches the server, which aborts the connection
+                # instead of ending the response, so the client never takes it for complete
+                raise RuntimeError('Response failed while streaming') from value
+            else:
+                await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+                break
+    finally:
+        watcher.cancel()
+        # Done, or abandoned (client gone, send failed, task cancelled): the view stops writing,
+        # and the buffer is emptied so that a view waiting on it is released
+        abandoned = disconnected = True
+        while not chunks.empty():
+            chunks.get_nowait()
+        # A view still reading the request body gets its end
+        while not body_chunks.empty():
+            body_chunks.get_nowait()
+        body_chunks.put_nowait((b'', False))
+        view.add_done_callback(_retrieve)
+    await view
+
+def _environ(scope, body):
+    """
+    Build the WSGI environ of an ASGI HTTP request
+    body: Stream of the request body, read while the view runs
+    """
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.input_terminated': True,  # The stream ends with the body, also without a Content-Length
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        'wsgi.file_wrapper': _FileWrapper
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[name] = value
+        else:
+            key = f'HTTP_{name}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+class _RequestBody(io.RawIOBase):
+    """
+    wsgi.input of a request: reads the body chunks received by the event loop, in the request thread
+    loop: Event loop of the request
+    chunks: asyncio.Queue of (data, more to come)
+    """
+    def __init__(self, loop, chunks):
+        self.loop = loop
+        self.chunks = chunks
+        self.pending = memoryview(b'')
+        self.done = False
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, buffer):
+        # Wait for the next chunk only when the previous one is used up
+        while not self.pending and not self.done:
+            data, more = asyncio.run_coroutine_threadsafe(self.chunks.get(), self.loop).result()
+            self.pending = memoryview(data)
+            self.done = not more
+        n = min(len(buffer), len(self.pending))
+        buffer[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        return n
+
+class _FileWrapper:
+    """
+    wsgi.file_wrapper: marks a response that is a whole file, so its path can be sent by the server
+    Iterating reads the file in blocks, for servers without the pathsend extension
+    """
+    def __init__(self, file, block_size=8192):
+        self.file = file
+        self.block_size = block_size
+        name = getattr(file, 'name', None)
+        self.path = os.path.abspath(name) if isinstance(name, str) else None
+    
+    def __iter__(self):
+        return iter(lambda: self.file.read(self.block_size), b'')
+    
+    def close(self):
+        self.file.close()
+
+def _retrieve(future):
+    """
+    Mark the result of a view that is not awaited as retrieved, its errors are reported by the response loop
+    """
+    if not future.cancelled():
+        future.exception()
+
+async def _send_simple(send, status, body, headers=()):
+    """
+    Send a complete JSON response
+    """
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())] + list(headers)
+    })
+    await send({'type': 'http.response.body', 'body': body})
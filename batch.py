@@ -0,0 +1,291 @@
+# QR Code Batch Module: Command line generator for large batches, streams rows in and images out with resumable progress
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import tarfile
+import time
+from collections import deque
+
+import theqrmodule  # Generation only, the web application (Flask) is not imported
+
+# Rows finished between two checkpoints
+CHECKPOINT_EVERY = 1000
+
+def read_rows(source, format):
+    """
+    Read the rows of an input stream one at a time
+    source: Text stream
+    format: 'lines' (one content per line), 'csv' (header row with a content column,
+            other columns are per-row options) or 'jsonl' (one content string or object per line)
+    return: Iterator of rows, a row that cannot be parsed is a ValueError
+    """
+    if format == 'csv':
+        reader = csv.DictReader(source)
+        if 'content' not in (reader.fieldnames or []):
+            raise ValueError('CSV needs a header row with a content column')
+        return reader
+    return _read_lines(source, format)
+
+def _read_lines(source, format):
+    """
+    Read the rows of a 'lines' or 'jsonl' input, blank lines are not rows
+    """
+    for line in source:
+        line = line.rstrip('\r\n')
+        if not line.strip():
+            continue
+        if format == 'lines':
+            yield {'content': line}
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield ValueError(f'Invalid JSON: {e}')
+            continue
+        yield {'content': row} if isinstance(row, str) else row
+
+def prepare_item(row, shared):
+    """
+    Turn an input row into an item of theqrmodule.generate_many
+    row: Row of read_rows
+    shared: Options used when a row does not set them
+    return: Item dict with 'content', 'version', 'ecl' and the custom parameters, raises ValueError for an invalid row
+    """
+    if isinstance(row, ValueError):
+        raise row
+    if not isinstance(row, dict):
+        raise ValueError('Item must be a string or an object')
+    # Empty per-row values (e.g. empty CSV cells) fall back to the shared options
+    values = {**shared, **{k: v for k, v in row.items() if v not in ('', None)}}
+    content = str(values.get('content', ''))
+    if not content:
+        raise ValueError('Please enter content')
+    version, ecl, options = theqrmodule.parse_options(values)
+    return {'content': content, 'version': version, 'ecl': ecl, **options}
+
+class DirectoryOutput:
+    """
+    Writes each image as a file of a directory, files of rows after the last checkpoint are overwritten on resume
+    """
+    def __init__(self, path, state=None):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+    
+    def add(self, name, data):
+        with open(os.path.join(self.path, name), 'wb') as f:
+            f.write(data)
+    
+    def sync(self):
+        """Files are closed after each image, nothing is buffered"""
+    
+    def state(self):
+        return {}
+    
+    def close(self):
+        pass
+
+class TarOutput:
+    """
+    Appends each image to an uncompressed tar archive, written member by member so that nothing is held in memory
+    state: Checkpoint state of an interrupted job, the archive is cut back to its last checkpoint and continued
+    """
+    def __init__(self, path, state=None):
+        offset = (state or {}).get('archive_size', 0)
+        self.file = open(path, 'r+b' if offset else 'wb')
+        self.file.truncate(offset)
+        self.file.seek(offset)
+        self.mtime = int(time.time())
+    
+    def add(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = self.mtime
+        info.mode = 0o644
+        self.file.write(info.tobuf(tarfile.USTAR_FORMAT))
+        self.file.write(data)
+        self.file.write(b'\0' * (-len(data) % tarfile.BLOCKSIZE))
+    
+    def sync(self):
+        """Flush the archive to disk before a checkpoint refers to its size"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+    
+    def state(self):
+        return {'archive_size': self.file.tell()}
+    
+    def close(self):
+        # End of archive: two zero blocks, padded to a whole record like tarfile does
+        end = self.file.tell() + 2 * tarfile.BLOCKSIZE
+        self.file.write(b'\0' * (2 * tarfile.BLOCKSIZE + (-end % tarfile.RECORDSIZE)))
+        self.file.close()
+
+def run(rows, output, manifest_path, checkpoint_path, shared=None, resume=False,
+        workers=None, verify_rate=None, checkpoint_every=CHECKPOINT_EVERY, progress=None):
+    """
+    Generate the QR codes of a stream of rows
+    rows: Iterable of rows (see read_rows), read lazily
+    output: Output directory, or path of a tar archive when it ends with '.tar'
+    manifest_path: CSV file listing every row (row, filename, version, content, error)
+    checkpoint_path: JSON file recording how many rows are done, removed when the job is complete
+    shared: Options used when a row does not set them
+    resume: True to continue after the rows recorded in the checkpoint, the same input must be given again
+    workers: Number of worker processes, see theqrmodule.generate_many
+    verify_rate: Fraction of the images decoded again and compared with their content
+    checkpoint_every: Rows between two checkpoints
+    progress: Optional function called as progress(rows done, rows failed) at every checkpoint
+    return: (Rows done, rows failed), including the rows of the resumed run
+    
+    Memory use is bounded: only the rows being generated by the workers are held at any time.
+    """
+    shared = shared or {}
+    state = {'rows': 0, 'failed': 0, 'manifest_size': 0}
+    if os.path.exists(checkpoint_path):
+        if not resume:
+            raise ValueError(f'{checkpoint_path} exists, resume the interrupted job or remove it')
+        with open(checkpoint_path, encoding='utf-8') as f:
+            state = json.load(f)
+    
+    writer = (TarOutput if output.endswith('.tar') else DirectoryOutput)(output, state)
+    # The manifest is cut back to its size at the last checkpoint as well
+    manifest_raw = open(manifest_path, 'r+b' if state['manifest_size'] else 'wb')
+    manifest_raw.truncate(state['manifest_size'])
+    manifest_raw.seek(state['manifest_size'])
+    manifest_file = io.TextIOWrapper(manifest_raw, encoding='utf-8', newline='')
+    manifest = csv.writer(manifest_file)
+    if not state['manifest_size']:
+        manifest.writerow(['row', 'filename', 'version', 'content', 'error'])
+    
+    # Rows read from the input, waiting for their results which come back in input order.
+    # Invalid rows carry their error and go through the workers as a placeholder item that fails at once,
+    # so they are recorded in order and bounded by the rows in flight like any other row.
+    in_flight = deque()
+    
+    def items():
+        for number, row in enumerate(rows):
+            if number < state['rows']:
+                continue  # Done before the interruption
+            content = str(row.get('content', '')) if isinstance(row, dict) else ''
+            try:
+                item = prepare_item(row, shared)
+            except ValueError as e:
+                in_flight.append((number, content, str(e)))
+                yield None
+                continue
+            in_flight.append((number, content, None))
+            yield item
+    
+    def record(result):
+        # Write the manifest row (and image) of the oldest row in flight
+        number, content, error = in_flight.popleft()
+        filename = f'qrcode_{number:08d}.png'
+        if error is None and result['error'] is None:
+            writer.add(filename, result['image'])
+            manifest.writerow([number, filename, result['version'], content, ''])
+        else:
+            manifest.writerow([number, '', '', content, error or result['error']])
+            state['failed'] += 1
+        state['rows'] = number + 1
+        if state['rows'] % checkpoint_every == 0:
+            checkpoint()
+    
+    def checkpoint():
+        writer.sync()
+        manifest_file.flush()
+        os.fsync(manifest_raw.fileno())
+        state['manifest_size'] = manifest_raw.tell()
+        state.update(writer.state())
+        # Replace the checkpoint atomically, a crash leaves the previous one
+        temporary = checkpoint_path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(temporary, checkpoint_path)
+        if progress is not None:
+            progress(state['rows'], state['failed'])
+    
+    try:
+        for result in theqrmodule.generate_many(items(), workers=workers, verify_rate=verify_rate):
+            record(result)
+    except BaseException:
+        # Interrupted (crash, Ctrl-C): the last checkpoint stays, the rows after it are generated again on resume
+        manifest_file.close()
+        raise
+    
+    writer.close()
+    manifest_file.close()
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return state['rows'], state['failed']
+
+def _parse_option(text):
+    """Parse NAME=VALUE"""
+    name, sep, value = text.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError(f'Expected NAME=VALUE, got {text!r}')
+    return name.strip(), value
+
+def main(argv=None):
+    """
+    Command line entry point
+    
+    Usage:
+        python batch.py urls.txt -o out/                       # One content per line, PNG files in out/
+        python batch.py rows.csv -o codes.tar --option ecl=H   # CSV with a content column, into a tar archive
+        cat rows.jsonl | python batch.py - --format jsonl -o out/
+        python batch.py rows.csv -o codes.tar --resume         # Continue an interrupted job
+    
+    return: Exit status, 1 if some rows failed (see the manifest)
+    """
+    parser = argparse.ArgumentParser(description='Generate QR codes for every row of a text, CSV or JSONL input')
+    parser.add_argument('input', help="Input file, '-' reads standard input")
+    parser.add_argument('-o', '--output', required=True, help="Output directory, or a tar archive when it ends with '.tar'")
+    parser.add_argument('--format', choices=('lines', 'csv', 'jsonl'),
+                        help='Input format (default from the file extension, lines for other files and standard input)')
+    parser.add_argument('--option', action='append', type=_parse_option, default=[], metavar='NAME=VALUE',
+                        help='Option for rows that do not set it, e.g. ecl=H or module_shape=circle (repeatable)')
+    parser.add_argument('--manifest', help='Manifest CSV (default manifest.csv in the output directory, or OUTPUT.manifest.csv)')
+    parser.add_argument('--checkpoint', help='Checkpoint file (default .checkpoint.json in the output directory, or OUTPUT.checkpoint.json)')
+    parser.add_argument('--checkpoint-every', type=int, default=CHECKPOINT_EVERY, help=f'Rows between checkpoints (default {CHECKPOINT_EVERY})')
+    parser.add_argument('--resume', action='store_true', help='Continue an interrupted job from its checkpoint')
+    parser.add_argument('--workers', type=int, help='Worker processes (default one per CPU)')
+    parser.add_argument('--verify-rate', type=float, help='Fraction of the images decoded again and checked (default QR_VERIFY_SAMPLE_RATE)')
+    args = parser.parse_args(argv)
+    
+    archive = args.output.endswith('.tar')
+    manifest = args.manifest or (args.output + '.manifest.csv' if archive else os.path.join(args.output, 'manifest.csv'))
+    checkpoint = args.checkpoint or (args.output + '.checkpoint.json' if archive else os.path.join(args.output, '.checkpoint.json'))
+    format = args.format or {'.csv': 'csv', '.jsonl': 'jsonl'}.get(os.path.splitext(args.input)[1].lower(), 'lines')
+    if not archive:
+        os.makedirs(args.output, exist_ok=True)
+    
+    start = time.perf_counter()
+    
+    def progress(done, failed):
+        print(f'{done} rows, {failed} failed, {done / (time.perf_counter() - start):.0f} rows/s', file=sys.stderr)
+    
+    if args.input == '-':
+        source = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8-sig', newline='')
+    else:
+        source = open(args.input, encoding='utf-8-sig', newline='')
+    try:
+        with source:
+            done, failed = run(
+                read_rows(source, format), args.output, manifest, checkpoint, shared=dict(args.option),
+                resume=args.resume, workers=args.workers, verify_rate=args.verify_rate,
+                checkpoint_every=args.checkpoint_every, progress=progress
+            )
+    except ValueError as e:
+        print(f'error: {e}', file=sys.stderr)
+        return 2
+    except KeyboardInterrupt:
+        print('Interrupted, continue with --resume', file=sys.stderr)
+        return 130
+    
+    print(f'{done} rows done, {failed} failed, manifest in {manifest}')
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
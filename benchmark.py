@@ -0,0 +1,337 @@
+# QR Code Benchmark Module: Times every generation stage and checks that the output stays bit-identical
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import data, ECC, structure, matrix, draw  # Stages being measured
+from constant import required_bytes, lindex, alphanum_list
+
+# Committed baseline timings and golden-output corpus
+BENCHMARK_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks')
+BASELINE_PATH = os.path.join(BENCHMARK_FOLDER, 'baseline.json')
+GOLDEN_PATH = os.path.join(BENCHMARK_FOLDER, 'golden.json')
+
+ECLS = ('L', 'M', 'Q', 'H')
+MODES = ('numeric', 'alphanumeric', 'byte', 'kanji')
+SHAPES = ('square', 'circle', 'diamond')
+
+# Characters used to fill each mode: byte content avoids digits and capitals so it stays one byte segment
+MODE_CHARACTERS = {
+    'numeric': '0123456789',
+    'alphanumeric': alphanum_list,
+    'byte': 'abcdefghijklmnopqrstuvwxyz!?#&=_',
+    'kanji': '亜唖娃阿哀愛挨姶逢葵茜穐悪握渥旭葦芦鯵梓圧斡扱宛姐虻飴絢綾鮎或粟袷安庵按暗案闇鞍杏以伊位依偉囲夷委威尉'
+}
+
+# Bits per character of each mode, used to size the content to the version
+MODE_BITS = {'numeric': 10 / 3, 'alphanumeric': 11 / 2, 'byte': 8, 'kanji': 13}
+
+# Rendering options of the draw benchmark and the golden images
+DRAW_OPTIONS = {'unit_size': 3, 'margin': 4, 'frame': True, 'border_size': 4}
+
+# Import time budget of the entry points: {module: (seconds, heavy dependencies the import may load)}
+# Heavy dependencies are imported on first use, a cold worker or batch process should not pay for them up front
+IMPORT_BUDGETS = {
+    'theqrmodule': (0.015, ()),
+    'verifier': (0.015, ()),
+    'batch': (0.02, ()),
+    'app': (0.15, ('flask',))
+}
+HEAVY_IMPORTS = ('numpy', 'PIL', 'flask', 'concurrent.futures.process')
+
+def make_content(ver, ecl, mode):
+    """
+    Build a deterministic content of one mode that fills about 90% of a version
+    ver: QR code version (1-40)
+    ecl: Error correction level (L/M/Q/H)
+    mode: 'numeric', 'alphanumeric', 'byte' or 'kanji'
+    return: String
+    """
+    capacity = 8 * required_bytes[ver-1][lindex[ecl]] - 4 - data.get_cci_len(ver, mode)
+    length = max(1, int(capacity / MODE_BITS[mode] * 0.9))
+    generator = random.Random(f'{ver}-{ecl}-{mode}')
+    return ''.join(generator.choice(MODE_CHARACTERS[mode]) for _ in range(length))
+
+def cases(versions, ecls, modes):
+    """
+    Iterate over the benchmark cases
+    return: Generator of (version, ecl, mode, content)
+    """
+    for ver in versions:
+        for ecl in ecls:
+            for mode in modes:
+                yield ver, ecl, mode, make_content(ver, ecl, mode)
+
+def best_time(func, repeat):
+    """
+    Run a function several times
+    return: Shortest run time in seconds, the least disturbed by other work on the machine
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return round(best, 7)
+
+def run(versions, ecls, modes, shapes, repeat):
+    """
+    Time every stage of QR code generation for each case
+    return: Dict with 'meta' (environment) and 'results' ({case key: seconds}),
+            keys look like 'matrix.mask|v10|M|byte' or 'draw.draw_qrcode|v10|M|byte|circle'
+    """
+    results = {}
+    folder = tempfile.mkdtemp()
+    for ver, ecl, mode, content in cases(versions, ecls, modes):
+        # Output of each stage, the input of the next one
+        ver, data_codewords = data.encode(ver, ecl, content)
+        ecc = ECC.encode(ver, ecl, data_codewords)
+        bits = structure.structure_final_bits(ver, ecl, data_codewords, ecc)
+        qrmatrix = matrix.get_qrmatrix(ver, ecl, bits)
+        base = matrix.get_template(ver)
+        placed = base.copy()
+        matrix.place_bits(bits, placed)
+    
+        key = f'v{ver}|{ecl}|{mode}'
+        results[f'data.encode|{key}'] = best_time(lambda: data.encode(ver, ecl, content), repeat)
+        results[f'ECC.encode|{key}'] = best_time(lambda: ECC.encode(ver, ecl, data_codewords), repeat)
+        results[f'structure.structure_final_bits|{key}'] = best_time(
+            lambda: structure.structure_final_bits(ver, ecl, data_codewords, ecc), repeat)
+        results[f'matrix.get_qrmatrix|{key}'] = best_time(lambda: matrix.get_qrmatrix(ver, ecl, bits), repeat)
+        results[f'matrix.mask|{key}'] = best_time(lambda: matrix.mask(base, placed), repeat)
+        for shape in shapes:
+            results[f'draw.draw_qrcode|{key}|{shape}'] = best_time(
+                lambda: draw.draw_qrcode(folder, qrmatrix, module_shape=shape, **DRAW_OPTIONS), repeat)
+    
+    return {'meta': environment(repeat), 'results': results}
+
+def environment(repeat):
+    """
+    Describe the machine and libraries the timings were taken with
+    """
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'numpy': matrix.np is not None,
+        'repeat': repeat,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    }
+
+def compare(results, baseline, threshold):
+    """
+    Compare timings against a baseline, stage by stage
+    Single measurements of a few milliseconds are noisy, so each stage is judged by the geometric mean
+    of its new/baseline time ratios over all cases both runs have in common.
+    results, baseline: Dicts returned by run
+    threshold: Allowed slowdown as a fraction (0.25 = 25% slower)
+    return: List of (stage, ratio, number of compared measurements, regressed), one per stage
+    """
+    logs = {}
+    for key, seconds in results['results'].items():
+        old = baseline['results'].get(key)
+        if not old or not seconds:
+            continue
+        logs.setdefault(key.split('|')[0], []).append(math.log(seconds / old))
+    
+    report = []
+    for stage, values in logs.items():
+        ratio = math.exp(sum(values) / len(values))
+        report.append((stage, ratio, len(values), ratio > 1 + threshold))
+    return report
+
+def summarize(results):
+    """
+    Total time per stage
+    return: {stage: seconds}
+    """
+    totals = {}
+    for key, seconds in results['results'].items():
+        stage = key.split('|')[0]
+        totals[stage] = totals.get(stage, 0) + seconds
+    return totals
+
+def golden(versions, ecls, modes, shapes):
+    """
+    Build the golden-output corpus: hashes of the output of every stage for each case
+    Images are hashed by their RGB pixels, so neither the image mode nor PNG encoder settings change the corpus
+    return: {case key: {stage: SHA-256 hex digest}}
+    """
+    corpus = {}
+    for ver, ecl, mode, content in cases(versions, ecls, modes):
+        ver, data_codewords = data.encode(ver, ecl, content)
+        ecc = ECC.encode(ver, ecl, data_codewords)
+        bits = structure.structure_final_bits(ver, ecl, data_codewords, ecc)
+        qrmatrix = matrix.get_qrmatrix(ver, ecl, bits)
+    
+        entry = {
+            'data.encode': _digest(repr(data_codewords)),
+            'ECC.encode': _digest(repr(ecc)),
+            'structure.structure_final_bits': _digest(str(bits)),
+            'matrix.get_qrmatrix': _digest(repr(qrmatrix.to_list()))
+        }
+        for shape in shapes:
+            pic = draw.render_qrcode(qrmatrix, module_shape=shape, **DRAW_OPTIONS)
+            entry[f'draw.render_qrcode|{shape}'] = _digest(pic.convert('RGB').tobytes())
+        corpus[f'v{ver}|{ecl}|{mode}'] = entry
+    return corpus
+
+def check_golden(corpus, expected):
+    """
+    Compare a corpus against the committed one
+    return: List of (case key, stage) whose output differs or is missing
+    """
+    return [
+        (key, stage)
+        for key, stages in expected.items()
+        for stage, digest in stages.items()
+        if corpus.get(key, {}).get(stage) != digest
+    ]
+
+def measure_imports(modules, repeat):
+    """
+    Time the import of modules, each in fresh interpreters
+    Bytecode caching is enabled as in a deployment, the first interpreter writes the cache and is not counted
+    modules: Module names
+    repeat: Number of timed interpreters per module, the fastest counts
+    return: {module: (seconds, heavy dependencies loaded by the import)}
+    """
+    folder = os.path.dirname(os.path.abspath(__file__))
+    env = {key: value for key, value in os.environ.items() if key != 'PYTHONDONTWRITEBYTECODE'}
+    results = {}
+    for module in modules:
+        code = (
+            f'import time; start = time.perf_counter(); import {module}; seconds = time.perf_counter() - start\n'
+            f'import json, sys; print(json.dumps([seconds, [m for m in {list(HEAVY_IMPORTS)!r} if m in sys.modules]]))'
+        )
+        best = None
+        for _ in range(repeat + 1):
+            output = subprocess.run([sys.executable, '-c', code], cwd=folder, env=env, check=True,
+                                    capture_output=True, text=True).stdout
+            seconds, loaded = json.loads(output.splitlines()[-1])
+            if best is None or seconds < best[0]:
+                best = (seconds, tuple(loaded))
+        results[module] = best
+    return results
+
+def _digest(value):
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    return hashlib.sha256(value).hexdigest()[:24]
+
+def _parse_versions(text):
+    """Parse '1-40' or '1,10,25,40' into a list of versions"""
+    versions = []
+    for part in text.split(','):
+        first, _, last = part.partition('-')
+        versions += range(int(first), int(last or first) + 1)
+    return versions
+
+def _load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def _save(path, value):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(value, f, indent=1, sort_keys=True)
+        f.write('\n')
+
+def main(argv=None):
+    """
+    Command line entry point
+    
+    Usage:
+        python benchmark.py run                     # Time all stages, compare with benchmarks/baseline.json
+        python benchmark.py --versions 1,10,40 run  # Only some versions
+        python benchmark.py run --update-baseline   # Record a new baseline (on the reference machine)
+        python benchmark.py golden                  # Prove every stage still produces the golden outputs
+        python benchmark.py golden --update         # Record the golden outputs of an intended change
+        python benchmark.py imports                 # Check the cold import time of the entry points
+    
+    return: Exit status, 1 if a stage regressed, an output differs or an import is over its budget
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the QR code generation stages and check the golden outputs')
+    parser.add_argument('--versions', default='1-40', help="Versions to run, e.g. '1-40' or '1,10,25,40' (default 1-40)")
+    parser.add_argument('--ecl', default='LMQH', help='Error correction levels (default LMQH)')
+    parser.add_argument('--modes', default=','.join(MODES), help='Comma separated encoding modes (default all)')
+    parser.add_argument('--shapes', default=','.join(SHAPES), help='Comma separated module shapes (default all)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    bench = commands.add_parser('run', help='Time every stage and compare against the baseline')
+    bench.add_argument('--repeat', type=int, default=3, help='Runs per measurement, the shortest counts (default 3)')
+    bench.add_argument('--output', help='Write the results as JSON to this file')
+    bench.add_argument('--baseline', default=BASELINE_PATH, help='Baseline results to compare against')
+    bench.add_argument('--threshold', type=float, default=0.10, help='Allowed slowdown per stage (default 0.10 = 10%%)')
+    bench.add_argument('--update-baseline', action='store_true', help='Write the results as the new baseline')
+    
+    check = commands.add_parser('golden', help='Check that every stage still produces the golden outputs')
+    check.add_argument('--update', action='store_true', help='Write the current outputs as the golden corpus')
+    
+    imports = commands.add_parser('imports', help='Check the cold import time of the entry points against their budget')
+    imports.add_argument('--repeat', type=int, default=5, help='Fresh interpreters per module, the fastest counts (default 5)')
+    
+    args = parser.parse_args(argv)
+    versions = _parse_versions(args.versions)
+    ecls = tuple(args.ecl.upper())
+    modes = tuple(args.modes.split(','))
+    shapes = tuple(args.shapes.split(','))
+    
+    if args.command == 'imports':
+        over = 0
+        for module, (seconds, loaded) in measure_imports(IMPORT_BUDGETS, args.repeat).items():
+            budget, allowed = IMPORT_BUDGETS[module]
+            early = [name for name in loaded if name not in allowed]
+            failed = seconds > budget or early
+            over += bool(failed)
+            note = f'  loads {", ".join(early)} at import' if early else ''
+            print(f'{"OVER" if failed else "ok":5s} {module:15s} {seconds * 1000:8.2f} ms  (budget {budget * 1000:.0f} ms){note}')
+        print(f'{len(IMPORT_BUDGETS)} entry points checked, {over} over budget')
+        return 1 if over else 0
+    
+    if args.command == 'golden':
+        corpus = golden(versions, ecls, modes, shapes)
+        if args.update:
+            _save(GOLDEN_PATH, corpus)
+            print(f'Golden corpus of {len(corpus)} cases written to {GOLDEN_PATH}')
+            return 0
+        expected = {key: value for key, value in _load(GOLDEN_PATH).items() if key in corpus}
+        mismatches = check_golden(corpus, expected)
+        for key, stage in mismatches:
+            print(f'MISMATCH {key} {stage}')
+        print(f'{len(expected)} cases checked, {len(mismatches)} mismatches')
+        return 1 if mismatches else 0
+    
+    results = run(versions, ecls, modes, shapes, args.repeat)
+    for stage, seconds in summarize(results).items():
+        print(f'{stage:35s} {seconds * 1000:10.2f} ms')
+    if args.output:
+        _save(args.output, results)
+    if args.update_baseline:
+        _save(args.baseline, results)
+        print(f'Baseline written to {args.baseline}')
+        return 0
+    if not os.path.exists(args.baseline):
+        print('No baseline to compare against')
+        return 0
+    
+    report = compare(results, _load(args.baseline), args.threshold)
+    for stage, ratio, count, regressed in report:
+        print(f'{"REGRESSION" if regressed else "ok":10s} {stage:35s} {ratio - 1:+7.1%} over {count} measurements')
+    regressions = sum(regressed for *_, regressed in report)
+    print(f'{len(report)} stages compared, {regressions} slower than the baseline by more than {args.threshold:.0%}')
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,74 @@
+# QR Code Bit Buffer Module: Stores the encoded bit stream as packed bytes instead of '0'/'1' strings
+
+class BitBuffer:
+    """
+    Growable bit stream, most significant bit first
+    Complete bytes are kept in a bytearray, the last incomplete byte in a small int
+    
+    Usage:
+        buffer = BitBuffer()
+        buffer.append(0b0010, 4)  # Append the 4 low bits of a value
+        len(buffer)               # Number of bits
+        list(buffer)              # Bits as ints 0/1
+        buffer.to_bytes()         # Packed bytes, last byte padded with 0
+    """
+    def __init__(self):
+        self._data = bytearray()
+        self._acc = 0      # Bits not yet forming a complete byte
+        self._acc_len = 0  # Number of bits in _acc (0-7)
+    
+    def append(self, value, length):
+        """
+        Append the low bits of a value
+        value: Non-negative integer
+        length: Number of bits to append, value is truncated to this length
+        """
+        self._acc = (self._acc << length) | (value & ((1 << length) - 1))
+        self._acc_len += length
+        if self._acc_len >= 8:
+            n = self._acc_len // 8
+            self._acc_len -= n * 8
+            self._data += (self._acc >> self._acc_len).to_bytes(n, 'big')
+            self._acc &= (1 << self._acc_len) - 1
+    
+    def append_bytes(self, data):
+        """
+        Append whole bytes
+        data: bytes, bytearray or list of ints (0-255)
+        """
+        if self._acc_len == 0:
+            self._data += bytes(data)
+        else:
+            self.append(int.from_bytes(bytes(data), 'big'), 8 * len(data))
+    
+    def extend(self, other):
+        """
+        Append all bits of another BitBuffer
+        """
+        self.append_bytes(other._data)
+        self.append(other._acc, other._acc_len)
+    
+    def to_bytes(self):
+        """
+        Get the packed bytes, the last incomplete byte is padded with 0
+        return: bytes
+        """
+        if self._acc_len:
+            return bytes(self._data) + bytes([self._acc << (8 - self._acc_len)])
+        return bytes(self._data)
+    
+    def __len__(self):
+        return len(self._data) * 8 + self._acc_len
+    
+    def __iter__(self):
+        for byte in self._data:
+            for k in range(7, -1, -1):
+                yield (byte >> k) & 1
+        for k in range(self._acc_len - 1, -1, -1):
+            yield (self._acc >> k) & 1
+    
+    def __str__(self):
+        return ''.join('1' if bit else '0' for bit in self)
+    
+    def __repr__(self):
+        return f"BitBuffer('{self}')"
@@ -0,0 +1,284 @@
+# QR Code Result Cache Module: Bounded in-process LRU cache and on-disk file cache for generated QR codes
+
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+class LRUCache:
+    """
+    Thread-safe least recently used cache with a byte budget
+    max_bytes: Total size of the cached values, the least recently used entries are evicted above it (0 disables the cache)
+    
+    Usage:
+        cache = LRUCache(32 * 1024 * 1024)
+        cache.put(key, value, size)  # size: number of bytes the value takes
+        cache.get(key)               # value, or None on a miss
+        cache.stats()                # hit/miss/eviction counters and current size
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, size), oldest first
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key):
+        """
+        Look up a value and mark it as most recently used
+        return: Cached value, or None if the key is not cached
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+    
+    def put(self, key, value, size):
+        """
+        Store a value, evicting least recently used entries until the cache fits its budget
+        size: Number of bytes the value takes, values larger than the whole budget are not stored
+        """
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+    
+    def clear(self):
+        """
+        Remove all entries, counters are kept
+        """
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+    
+    def stats(self):
+        """
+        Get the cache counters for monitoring
+        return: Dict with hits, misses, evictions, items, bytes and max_bytes
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'items': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes
+            }
+
+class DiskCache:
+    """
+    Thread-safe cache of files in a directory, named after a hash of their key, with a byte budget and a time to live
+    path: Directory of the files
+    max_bytes: Total size of the files, the least recently used files are removed above it (0 disables the cache)
+    ttl: Seconds a file is kept after it was written, 0 keeps files until they are evicted
+    prefix, suffix: File names are prefix + 32 hex digits + suffix, other files of the directory (e.g. the
+                    qrcode_*.png files of draw.save_qrcode) are never served or removed
+    
+    Usage:
+        cache = DiskCache(folder, 256 * 1024 * 1024, 7 * 24 * 3600)
+        name = cache.put(key, data)  # File name of the value, None if it was not stored
+        cache.get(name)              # (path, strong ETag), or None when missing or expired
+        cache.stats()                # hit/miss/eviction/expiration counters and current size
+    
+    Files written before a restart are picked up again. Values of a key never change, so
+    a file that already exists is not written again.
+    """
+    def __init__(self, path, max_bytes, ttl=0, prefix='dl_', suffix='.png'):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.prefix = prefix
+        self.suffix = suffix
+        self._pattern = re.compile(re.escape(prefix) + '[0-9a-f]{32}' + re.escape(suffix))
+        self._entries = OrderedDict()  # name -> [size, time written, ETag or None until first needed], least recently used first
+        self._lock = threading.Lock()
+        self._next_purge = 0
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        os.makedirs(path, exist_ok=True)
+        self._scan()
+    
+    def name(self, key):
+        """
+        Get the file name of a key
+        key: Hashable key with a stable repr, e.g. the tuple of theqrmodule.cache_key
+        return: File name
+        """
+        return f'{self.prefix}{hashlib.sha256(repr(key).encode()).hexdigest()[:32]}{self.suffix}'
+    
+    def get(self, name):
+        """
+        Look up a file and mark it as most recently used
+        name: File name, see name
+        return: (Path of the file, strong ETag of its content), or None if it is not cached or has expired
+        """
+        if not self._pattern.fullmatch(name):
+            return None  # Not a cache file, also rejects any path
+        path = os.path.join(self.path, name)
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                entry = self._adopt(name)
+            if entry is not None and self.ttl and time.time() - entry[1] > self.ttl:
+                self._remove(name)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(name)
+            etag = entry[2]
+            if etag is not None:
+                self.hits += 1
+                return path, etag
+        
+        # Files found on disk get their ETag when they are first served
+        try:
+            with open(path, 'rb') as f:
+                etag = hashlib.sha256(f.read()).hexdigest()[:32]
+        except FileNotFoundError:
+            etag = None
+        with self._lock:
+            if etag is None:
+                # Removed behind the cache's back: forget the entry (the file is already gone) and count a miss
+                if self._entries.get(name) is entry:
+                    del self._entries[name]
+                    self.bytes -= entry[0]
+                self.misses += 1
+                return None
+            entry[2] = etag
+            self.hits += 1
+        return path, etag
+    
+    def put(self, key, data):
+        """
+        Store the value of a key unless it is already stored, evicting least recently used files above the budget
+        data: File content (bytes), values larger than the whole budget are not stored
+        return: File name, None if the value was not stored
+        """
+        if len(data) > self.max_bytes:
+            return None
+        name = self.name(key)
+        path = os.path.join(self.path, name)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(name)
+            # A file removed behind the cache's back (cleanup by hand, failed removal) is written again
+            if entry is not None and not (self.ttl and now - entry[1] > self.ttl) and os.path.exists(path):
+                self._entries.move_to_end(name)
+                return name
+        
+        # Write to a temporary file first, concurrent readers never see a partial file
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+        
+        with self._lock:
+            old = self._entries.pop(name, None)
+            if old is not None:
+                self.bytes -= old[0]
+            self._entries[name] = [len(data), now, hashlib.sha256(data).hexdigest()[:32]]
+            self.bytes += len(data)
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            if self.ttl and now >= self._next_purge:
+                self._purge(now)
+        return name
+    
+    def purge(self):
+        """
+        Remove all expired files
+        """
+        with self._lock:
+            self._purge(time.time())
+    
+    def stats(self):
+        """
+        Get the cache counters for monitoring
+        return: Dict with hits, misses, evictions, expirations, items, bytes and max_bytes
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'items': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes
+            }
+    
+    def _scan(self):
+        """
+        Index the files already in the directory, oldest first, and apply the budget and time to live
+        """
+        found = []
+        for item in os.scandir(self.path):
+            if self._pattern.fullmatch(item.name):
+                stat = item.stat()
+                found.append((stat.st_mtime, item.name, stat.st_size))
+        with self._lock:
+            for mtime, name, size in sorted(found):
+                self._entries[name] = [size, mtime, None]
+                self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            if self.ttl:
+                self._purge(time.time())
+    
+    def _adopt(self, name):
+        """
+        Index a file written by another process, called with the lock held
+        return: Entry, or None if there is no such file
+        """
+        try:
+            stat = os.stat(os.path.join(self.path, name))
+        except FileNotFoundError:
+            return None
+        entry = self._entries[name] = [stat.st_size, stat.st_mtime, None]
+        self.bytes += stat.st_size
+        return entry
+    
+    def _purge(self, now):
+        """
+        Remove expired files, called with the lock held, at most once per tenth of the time to live
+        """
+        for name in [name for name, entry in self._entries.items() if now - entry[1] > self.ttl]:
+            self._remove(name)
+            self.expirations += 1
+        self._next_purge = now + self.ttl / 10
+    
+    def _remove(self, name):
+        """
+        Remove a file and its entry, called with the lock held
+        """
+        size = self._entries.pop(name)[0]
+        self.bytes -= size
+        try:
+            os.remove(os.path.join(self.path, name))
+        except FileNotFoundError:
+            pass  # Already removed, e.g. by another process
@@ -1,13 +1,20 @@
 # QR Code Data Encoding Module: Handles string to binary data encoding conversion
 
-from constant import char_cap, required_bytes, mindex, lindex, num_list, alphanum_list, grouping_list, mode_indicator
+from constant import required_bytes, mindex, lindex, num_list, alphanum_list, grouping_list, mode_indicator, version_ranges
+from constant import structured_append_indicator, structured_append_bits, max_structured_append
+from bitbuffer import BitBuffer
+import logging
+import metrics
+
+logger = logging.getLogger(__name__)
        
-def encode(ver, ecl, str):
+def encode(ver, ecl, str, structured_append=None):
     """
     Encode a string
     ver: QR code version
     ecl: Error correction level
     str: String to encode
+    structured_append: Optional (symbol position, number of symbols, parity) of a symbol in a Structured Append set, see split
     return: Encoded string
     """
     # Four encoding modes: Numeric, Alphanumeric, Byte, Kanji 
@@ -18,30 +25,40 @@ def encode(ver, ecl, str):
             'kanji': kanji_encoding                # Kanji encoding method
             }
           
-    # Call analyse function to determine the most suitable encoding mode and version
-    ver, mode = analyse(ver, ecl, str)
-    print('line 16: mode:', mode)
+    # Call analyse function to determine the most suitable encoding modes and version
+    ver, segments = analyse(ver, ecl, str, structured_append_bits if structured_append else 0)
+    metrics.log_sampled(logger, logging.DEBUG, 'version %s-%s, modes: %s', ver, ecl, [mode for mode, _ in segments])
+    
+    # Structured Append header goes before the first segment: position and count - 1 in 4 bits each, then the parity
+    code = BitBuffer()
+    if structured_append:
+        position, total, parity = structured_append
+        code.append(structured_append_indicator, 4)
+        code.append(position, 4)
+        code.append(total - 1, 4)
+        code.append(parity, 8)
     
-    # Generate initial encoding (Mode Indicator + Character Count Indicator + Actual data encoding)
-    code = mode_indicator[mode] + get_cci(ver, mode, str) + mode_encoding[mode](str)
+    # Generate initial encoding, for each segment: Mode Indicator + Character Count Indicator + Actual data encoding
+    for mode, text in segments:
+        code.append(mode_indicator[mode], 4)
+        code.extend(get_cci(ver, mode, text))
+        code.extend(mode_encoding[mode](text))
     
     # Add terminator
     rqbits = 8 * required_bytes[ver-1][lindex[ecl]]  # Calculate required number of bits
     b = rqbits - len(code)
-    code += '0000' if b >= 4 else '0' * b  # Add 4 zeros if space is sufficient, otherwise add maximum possible
+    code.append(0, min(max(b, 0), 4))  # Add 4 zeros if space is sufficient, otherwise add maximum possible
     
     # Ensure encoding length is a multiple of 8 (byte alignment)
-    while len(code) % 8 != 0:
-        code += '0'
+    code.append(0, -len(code) % 8)
     
-    # If the string is still too short, add padding bytes
-    while len(code) < rqbits:    
-        code += '1110110000010001' if rqbits - len(code) >= 16 else '11101100'
+    # If the string is still too short, add padding bytes (11101100 and 00010001 alternately)
+    pad_bytes = (rqbits - len(code)) // 8
+    code.append_bytes(b'\xec\x11' * (pad_bytes // 2) + b'\xec' * (pad_bytes % 2))
+    
+    # Byte array of the data codewords
+    data_code = list(code.to_bytes())
     
-    # Convert binary string to byte array
-    data_code = [code[i:i+8] for i in range(len(code)) if i%8 == 0]
-    data_code = [int(i,2) for i in data_code]
-
     # Group data codewords according to version and error correction level
     g = grouping_list[ver-1][lindex[ecl]]
     data_codewords, i = [], 0
@@ -54,66 +71,200 @@ def encode(ver, ecl, str):
     
     return ver, data_codewords  # Return actual version used and data codewords
     
-def analyse(ver, ecl, str):
+def analyse(ver, ecl, str, header_bits=0):
     """
-    Automatically determine the most suitable encoding mode
-    ver: QR code version
+    Automatically determine the most suitable encoding modes and the version
+    ver: QR code version, the result is never lower than this (0 means automatic)
     ecl: Error correction level
     str: String to encode
-    return: Most suitable encoding mode
+    header_bits: Bits used before the segments (the Structured Append header)
+    return: (Version, list of (mode, text) segments)
     """
-    # Choose optimal encoding mode based on character content
-    if all(i in num_list for i in str):
-        mode = 'numeric'
-    elif all(i in alphanum_list for i in str):
-        mode = 'alphanumeric'
-    else:
-        mode = 'byte'
-    
-    # Determine the minimum version that can accommodate the current content
-    m = mindex[mode]  # Get mode index
-    l = len(str)      # String length
-    for i in range(40):
-        if char_cap[ecl][i][m] > l:  # Find the first version that can accommodate the current character count
-            ver = i + 1 if i+1 > ver else ver  # Update if higher version is needed
-            break
- 
-    return ver, mode
+    # Character count indicator lengths change between version ranges, so each range has its own best segmentation
+    for first, last in version_ranges:
+        if last < ver:
+            continue
+        segments = segment(first, str)
+        bits = get_bits_length(first, segments) + header_bits
+        
+        # Find the first version that can hold the encoded bits
+        for v in range(max(first, ver), last + 1):
+            if bits <= 8 * required_bytes[v-1][lindex[ecl]]:
+                return v, segments
+    
+    raise ValueError(f'Content is too long for a version 40-{ecl} QR code, split it over a Structured Append set')
+
+def split(ver, ecl, str):
+    """
+    Split a string over the symbols of a Structured Append set, each symbol is filled as far as it goes
+    ver: QR code version of every symbol (1-40)
+    ecl: Error correction level
+    str: String to encode
+    return: List of (text, (symbol position, number of symbols, parity)), one per symbol,
+            raises ValueError when more than 16 symbols would be needed
+    """
+    capacity = 8 * required_bytes[ver-1][lindex[ecl]] - structured_append_bits
+    parts = []
+    start = 0
+    while start < len(str) or not parts:
+        if len(parts) == max_structured_append:
+            raise ValueError(f'Content is too long for {max_structured_append} version {ver}-{ecl} QR codes')
+        
+        # One pass of the segmentation over the rest of the content: the part ends
+        # before the first character that makes the best segmentation of the part too long
+        end = start
+        for costs, _ in segment_costs(ver, str[start:]):
+            if (min(costs) + 5) // 6 > capacity:
+                break
+            end += 1
+        if end == start and start < len(str):
+            raise ValueError(f'Content does not fit in version {ver}-{ecl} Structured Append symbols')
+        parts.append(str[start:end])
+        start = end
+    
+    # Every symbol carries the parity of the whole content
+    p = parity(str)
+    return [(text, (position, len(parts), p)) for position, text in enumerate(parts)]
+
+def parity(str):
+    """
+    Structured Append parity: XOR of all bytes of the content, as encoded by the byte and kanji modes
+    str: String to encode
+    return: 8 bit parity
+    """
+    p = 0
+    for c in str:
+        try:
+            b = c.encode('iso-8859-1')
+        except UnicodeEncodeError:
+            b = c.encode('shift_jis')
+        for byte in b:
+            p ^= byte
+    return p
+
+def segment(ver, str):
+    """
+    Split a string into numeric/alphanumeric/byte/kanji segments with the lowest total bit length
+    Dynamic programming over the characters: for each mode, the cheapest cost of encoding the prefix
+    with the current segment in that mode. Costs are counted in 1/6 bit so numeric (10 bits per 3 characters)
+    and alphanumeric (11 bits per 2 characters) characters have whole costs.
+    ver: QR code version (only its version range matters)
+    str: String to encode
+    return: List of (mode, text) segments
+    """
+    if not str:
+        return []
+    
+    modes = ('numeric', 'alphanumeric', 'byte', 'kanji')
+    char_modes = []  # char_modes[i][m]: mode of character i when the segment after it is in mode m
+    for prev_costs, cur_modes in segment_costs(ver, str):
+        char_modes.append(cur_modes)
+    
+    # Walk back from the cheapest final mode to get the mode of every character
+    m = min(range(4), key=lambda i: prev_costs[i])
+    result = [None] * len(str)
+    for i in range(len(str) - 1, -1, -1):
+        result[i] = char_modes[i][m]
+        m = modes.index(result[i])
+    
+    # Merge runs of characters with the same mode into segments
+    segments = []
+    for i, c in enumerate(str):
+        if segments and segments[-1][0] == result[i]:
+            segments[-1][1] += c
+        else:
+            segments.append([result[i], c])
+    return [(mode, text) for mode, text in segments]
+
+def segment_costs(ver, str):
+    """
+    The dynamic programming steps of segment, one per character
+    ver: QR code version (only its version range matters)
+    str: String to encode
+    return: Iterator of (costs, modes) after each character: for each mode, the cost in 1/6 bit of the cheapest
+            segmentation of the prefix with the current segment in that mode, and the mode of the character in it.
+            The exact bit length of the prefix is (min(costs) + 5) // 6.
+    """
+    head_costs = [(4 + get_cci_len(ver, mode)) * 6 for mode in ('numeric', 'alphanumeric', 'byte', 'kanji')]  # Mode indicator + character count indicator
+    
+    prev_costs = head_costs[:]
+    for c in str:
+        cur_costs = [None] * 4
+        cur_modes = [None] * 4
+        if c in num_list:
+            cur_costs[0], cur_modes[0] = prev_costs[0] + 20, 'numeric'
+        if c in alphanum_list:
+            cur_costs[1], cur_modes[1] = prev_costs[1] + 33, 'alphanumeric'
+        if kanji_value(c) is not None:
+            cur_costs[3], cur_modes[3] = prev_costs[3] + 78, 'kanji'
+        try:
+            cur_costs[2], cur_modes[2] = prev_costs[2] + len(c.encode('iso-8859-1')) * 48, 'byte'
+        except UnicodeEncodeError:
+            if cur_modes[3] is None:
+                raise  # No mode can encode this character
+        
+        # Starting a new segment after this character: round up to whole bits, then pay the new header
+        for to in range(4):
+            for frm in range(4):
+                if cur_modes[frm] is None:
+                    continue
+                cost = (cur_costs[frm] + 5) // 6 * 6 + head_costs[to]
+                if cur_modes[to] is None or cost < cur_costs[to]:
+                    cur_costs[to], cur_modes[to] = cost, cur_modes[frm]
+        
+        yield cur_costs, cur_modes
+        prev_costs = cur_costs
+
+def get_bits_length(ver, segments):
+    """
+    Calculate the exact number of bits of encoded segments, without terminator and padding
+    ver: QR code version (only its version range matters)
+    segments: List of (mode, text) segments
+    return: Number of bits
+    """
+    bits = 0
+    for mode, text in segments:
+        n = len(text)
+        if mode == 'numeric':
+            data_bits = 10 * (n // 3) + (0, 4, 7)[n % 3]
+        elif mode == 'alphanumeric':
+            data_bits = 11 * (n // 2) + 6 * (n % 2)
+        elif mode == 'byte':
+            data_bits = 8 * len(text.encode('iso-8859-1'))
+        else:
+            data_bits = 13 * n
+        bits += 4 + get_cci_len(ver, mode) + data_bits
+    return bits
 
 def numeric_encoding(str):
     """
     Numeric encoding
     str: String to encode
-    return: Encoded string
+    return: Encoded bits (BitBuffer)
     """
     str_list = [str[i:i+3] for i in range(0,len(str),3)]
-    code = ''
+    code = BitBuffer()
     for i in str_list:
         rqbin_len = 10
         if len(i) == 1: 
             rqbin_len = 4
         elif len(i) == 2:
             rqbin_len = 7
-        code_temp = bin(int(i))[2:]
-        code += ('0'*(rqbin_len - len(code_temp)) + code_temp)
+        code.append(int(i), rqbin_len)
     return code
     
 def alphanumeric_encoding(str):
     """
     Alphanumeric encoding
     str: String to encode
-    return: Encoded string
+    return: Encoded bits (BitBuffer)
     """
     code_list = [alphanum_list.index(i) for i in str]
-    code = ''
+    code = BitBuffer()
     for i in range(1, len(code_list), 2):
-        c = bin(code_list[i-1] * 45 + code_list[i])[2:]
-        c = '0'*(11-len(c)) + c
-        code += c
-    if i != len(code_list) - 1:
-        c = bin(code_list[-1])[2:]
-        c = '0'*(6-len(c)) + c
-        code += c
+        code.append(code_list[i-1] * 45 + code_list[i], 11)
+    if len(code_list) % 2:
+        code.append(code_list[-1], 6)
     
     return code
     
@@ -121,22 +272,44 @@ def byte_encoding(str):
     """
     Byte encoding
     str: String to encode
-    return: Encoded string
+    return: Encoded bits (BitBuffer)
     """
-    code = ''
-    for i in str:
-        c = bin(ord(i.encode('iso-8859-1')))[2:]
-        c = '0'*(8-len(c)) + c
-        code += c
+    code = BitBuffer()
+    code.append_bytes(str.encode('iso-8859-1'))
     return code
     
 def kanji_encoding(str):
     """
     Kanji encoding
-    str: String to encode
-    return: Encoded string
+    str: String to encode (characters in the Shift JIS double-byte kanji ranges)
+    return: Encoded bits (BitBuffer)
+    """
+    code = BitBuffer()
+    for i in str:
+        code.append(kanji_value(i), 13)
+    return code
+
+def kanji_value(char):
+    """
+    Get the 13 bit kanji mode value of a character
+    char: Character
+    return: Value, or None if the character is not a Shift JIS kanji (0x8140-0x9FFC, 0xE040-0xEBBF)
     """
-    pass
+    try:
+        b = char.encode('shift_jis')
+    except UnicodeEncodeError:
+        return None
+    if len(b) != 2:
+        return None
+    
+    code = (b[0] << 8) | b[1]
+    if 0x8140 <= code <= 0x9FFC:
+        code -= 0x8140
+    elif 0xE040 <= code <= 0xEBBF:
+        code -= 0xC140
+    else:
+        return None
+    return (code >> 8) * 0xC0 + (code & 0xFF)
     
 def get_cci(ver, mode, str):
     """
@@ -144,20 +317,28 @@ def get_cci(ver, mode, str):
     ver: QR code version
     mode: Encoding mode
     str: String to encode
-    return: Character Count Indicator
+    return: Character Count Indicator (BitBuffer)
+    """
+    # Character count as a cci_len bit number (byte mode counts bytes)
+    count = len(str.encode('iso-8859-1')) if mode == 'byte' else len(str)
+    cci = BitBuffer()
+    cci.append(count, get_cci_len(ver, mode))
+    return cci
+
+def get_cci_len(ver, mode):
+    """
+    Get the bit length of the Character Count Indicator
+    ver: QR code version
+    mode: Encoding mode
+    return: Number of bits
     """
     # Determine the bit length of the Character Count Indicator based on version range and encoding mode
     if 1 <= ver <= 9:
-        cci_len = (10, 9, 8, 8)[mindex[mode]]  # Corresponding to Numeric, Alphanumeric, Byte, Kanji modes
+        return (10, 9, 8, 8)[mindex[mode]]  # Corresponding to Numeric, Alphanumeric, Byte, Kanji modes
     elif 10 <= ver <= 26:
-        cci_len = (12, 11, 16, 10)[mindex[mode]]
+        return (12, 11, 16, 10)[mindex[mode]]
     else:
-        cci_len = (14, 13, 16, 12)[mindex[mode]]
-        
-    # Convert character count to binary, ensuring length meets requirements
-    cci = bin(len(str))[2:]
-    cci = '0' * (cci_len - len(cci)) + cci
-    return cci
+        return (14, 13, 16, 12)[mindex[mode]]
 
 # Code for testing
 if __name__ == '__main__':
@@ -1,14 +1,94 @@
 # QR Code Drawing Module: Converts QR matrix to visual image, supporting various custom styles
 
-from PIL import Image, ImageDraw, ImageFilter
 import os
+import io
+import hashlib
+import tempfile
+from lazyimport import lazy_module
+
+# PIL is imported on first use, so that matrix-only work (steps, vector output) does not load it
+Image = lazy_module('PIL.Image')
+ImageChops = lazy_module('PIL.ImageChops')
+ImageColor = lazy_module('PIL.ImageColor')
+ImageDraw = lazy_module('PIL.ImageDraw')
+ImageFilter = lazy_module('PIL.ImageFilter')
+
+# Module stamps per (shape, unit_size), drawn on first use: {(shape, unit_size): [(offset, tile), ...]}
+_stamp_cache = {}
 
 def draw_qrcode(abspath, qrmatrix, **kwargs):
     """
-    Draw QR code with customizable appearance
+    Draw QR code and save it as a PNG file named after its content
+    
+    Parameters:
+    abspath: Folder to save the QR code
+    qrmatrix: QR matrix
+    kwargs: Custom parameters, see render_qrcode and encode_png
+    
+    return: Path where QR code is saved
+    """
+    return save_qrcode(abspath, qrcode_bytes(qrmatrix, **kwargs))
+
+def qrcode_bytes(qrmatrix, fp=None, **kwargs):
+    """
+    Draw QR code and encode it as PNG in memory, nothing is written to disk
+    
+    Parameters:
+    qrmatrix: QR matrix
+    fp: Optional file-like object the PNG is also written to
+    kwargs: Custom parameters, see render_qrcode and encode_png
+    
+    return: PNG file content (bytes)
+    """
+    return encode_png(render_qrcode(qrmatrix, **kwargs), fp, **kwargs)
+
+def encode_png(pic, fp=None, **kwargs):
+    """
+    Encode a rendered QR code image as PNG in memory
+    Two-color palette images are written with 1 bit per pixel
+    
+    Parameters:
+    pic: PIL image, see render_qrcode
+    fp: Optional file-like object the PNG is also written to
+    
+    Custom parameters (other render parameters are ignored):
+    compress_level: zlib compression level, 0 (none) to 9 (smallest), default 6
+    optimize: Whether to search for the smallest encoding (implies level 9, slower), default False
+    
+    return: PNG file content (bytes)
+    """
+    buffer = io.BytesIO()
+    pic.save(buffer, format='PNG', compress_level=kwargs.get('compress_level', 6), optimize=kwargs.get('optimize', False))
+    png = buffer.getvalue()
+    if fp is not None:
+        fp.write(png)
+    return png
+
+def save_qrcode(abspath, png):
+    """
+    Save PNG bytes under a content-addressed name, so different QR codes never overwrite each other
     
     Parameters:
     abspath: Folder to save the QR code
+    png: PNG file content (bytes)
+    
+    return: Path of the file, qrcode_<first 16 hex digits of the SHA-256 of the content>.png
+    """
+    saving = os.path.join(abspath, f'qrcode_{hashlib.sha256(png).hexdigest()[:16]}.png')
+    # The same content always gets the same name, so an existing file is already correct
+    if not os.path.exists(saving):
+        # Write to a temporary file first, concurrent readers never see a partial image
+        fd, tmp = tempfile.mkstemp(dir=abspath, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(png)
+        os.replace(tmp, saving)
+    return saving
+
+def render_qrcode(qrmatrix, **kwargs):
+    """
+    Draw QR code with customizable appearance
+    
+    Parameters:
     qrmatrix: QR matrix
     
     Custom parameters:
@@ -20,8 +100,10 @@ def draw_qrcode(abspath, qrmatrix, **kwargs):
     frame: Whether to add a frame, default True
     margin: Margin size, default 4 units
     filter_name: Image filter, options 'none', 'edge_enhance', 'smooth'
+    color_mode: 'auto' renders into a two-color palette image ('P') unless a filter is applied,
+                'rgb' always renders a 24-bit image; default 'auto'
     
-    return: Path where QR code is saved
+    return: PIL image, the pixel colors are the same in every color mode
     """
     # Get custom parameters
     background_color = kwargs.get('background_color', 'white')
@@ -32,49 +114,29 @@ def draw_qrcode(abspath, qrmatrix, **kwargs):
     frame = kwargs.get('frame', True)
     margin = kwargs.get('margin', 4)
     filter_name = kwargs.get('filter_name', 'none')
+    color_mode = kwargs.get('color_mode', 'auto')
     
     # Calculate QR code size
     qr_width = len(qrmatrix)
     total_size = (qr_width + 2 * margin) * unit_size
     
-    # Create image
-    pic = Image.new('RGB', [total_size, total_size], background_color)
+    # Create image, foreground is the pixel value of dark modules in its mode
+    filtered = filter_name in ('edge_enhance', 'smooth')
+    pic, foreground = new_image(total_size, background_color, foreground_color, 'rgb' if filtered else color_mode)
     draw = ImageDraw.Draw(pic)
     
-    # Draw each module of the QR code
-    for y in range(qr_width):
-        for x in range(qr_width):
-            if qrmatrix[y][x]:
-                # Calculate module coordinates
-                x_pos = (x + margin) * unit_size
-                y_pos = (y + margin) * unit_size
-                
-                # Draw module based on selected shape
-                if module_shape == 'square':  # Square module
-                    draw.rectangle(
-                        [x_pos, y_pos, x_pos + unit_size, y_pos + unit_size],
-                        fill=foreground_color
-                    )
-                elif module_shape == 'circle': # Circle module
-                    draw.ellipse(
-                        [x_pos, y_pos, x_pos + unit_size, y_pos + unit_size],
-                        fill=foreground_color
-                    )
-                elif module_shape == 'diamond': # Diamond module
-                    half_unit = unit_size / 2
-                    points = [
-                        (x_pos + half_unit, y_pos),
-                        (x_pos + unit_size, y_pos + half_unit),
-                        (x_pos + half_unit, y_pos + unit_size),
-                        (x_pos, y_pos + half_unit)
-                    ]
-                    draw.polygon(points, fill=foreground_color)
+    # Square modules: paste all of them at once from a scaled one pixel per module mask
+    if module_shape == 'square':
+        paste_square_modules(pic, qrmatrix, foreground, unit_size, margin)
+    # Circle and diamond modules: composite a pre-rendered module stamp at every dark module
+    elif module_shape in ('circle', 'diamond'):
+        paste_stamped_modules(pic, qrmatrix, module_shape, foreground, unit_size, margin)
     
     # Add frame
     if frame:
         draw.rectangle(
             [0, 0, total_size - 1, total_size - 1],
-            outline=foreground_color,
+            outline=foreground,
             width=border_size
         )
     
@@ -85,7 +147,193 @@ def draw_qrcode(abspath, qrmatrix, **kwargs):
         elif filter_name == 'smooth':
             pic = pic.filter(ImageFilter.SMOOTH)
     
-    # Save image
-    saving = os.path.join(abspath, 'qrcode.png')
-    pic.save(saving)
-    return saving
\ No newline at end of file
+    return pic
+
+def new_image(size, background_color, foreground_color, color_mode='auto'):
+    """
+    Create the image a QR code is drawn on, filled with the background color
+    Modules and frame are drawn without anti-aliasing, so the image only ever holds these two colors:
+    a two-color image takes a third of the memory of RGB and is encoded as a 1-bit PNG.
+    
+    size: Width and height in pixels
+    background_color, foreground_color: Colors
+    color_mode: 'auto' for a two-color image, 'rgb' for a 24-bit image (needed by filters)
+    return: (PIL image, pixel value of the foreground color in the mode of the image)
+    """
+    if color_mode == 'rgb':
+        return Image.new('RGB', [size, size], background_color), foreground_color
+    
+    # Palette index 0 is the background, 1 the foreground. A two entry palette image is written as a
+    # 1-bit PNG without row filters, smaller and faster to encode than a mode '1' (grayscale) image.
+    pic = Image.new('P', [size, size], 0)
+    pic.putpalette(ImageColor.getrgb(background_color)[:3] + ImageColor.getrgb(foreground_color)[:3])
+    return pic, 1
+
+def paste_square_modules(pic, qrmatrix, color, unit_size, margin):
+    """
+    Paste all square modules with a few buffer operations instead of one rectangle per module
+    The result is pixel-identical to drawing every dark module with
+    draw.rectangle([x_pos, y_pos, x_pos + unit_size, y_pos + unit_size]), which covers
+    unit_size + 1 pixels in each direction, so the scaled mask is pasted at 4 offsets (0 or 1 pixel right/down).
+    
+    pic: Image to draw on
+    qrmatrix: QR matrix
+    color: Module color, as a pixel value of the mode of pic
+    unit_size: Size of each module in pixels
+    margin: Margin size in modules
+    """
+    qr_width = len(qrmatrix)
+    scaled = module_mask(qrmatrix).resize((qr_width * unit_size, qr_width * unit_size), Image.NEAREST)
+    origin = margin * unit_size
+    for dx, dy in ((0, 0), (1, 0), (0, 1), (1, 1)):
+        pic.paste(color, (origin + dx, origin + dy), scaled)
+
+def paste_stamped_modules(pic, qrmatrix, shape, color, unit_size, margin):
+    """
+    Paste all circle or diamond modules with a few buffer operations instead of drawing one shape per module
+    The stamp tiles of the shape are repeated over the whole matrix, cut out by the scaled module mask
+    and pasted with the module color. The result is pixel-identical to drawing every dark module with
+    draw.ellipse / draw.polygon in the box [x_pos, y_pos, x_pos + unit_size, y_pos + unit_size].
+    
+    pic: Image to draw on
+    qrmatrix: QR matrix
+    shape: Module shape, 'circle' or 'diamond'
+    color: Module color, as a pixel value of the mode of pic
+    unit_size: Size of each module in pixels
+    margin: Margin size in modules
+    """
+    side = len(qrmatrix) * unit_size
+    scaled = module_mask(qrmatrix).convert('1').resize((side, side), Image.NEAREST)
+    origin = margin * unit_size
+    for (dx, dy), tile in get_stamp_tiles(shape, unit_size):
+        # Keep the stamp pixels that fall on dark modules only
+        mask = ImageChops.logical_and(scaled, repeat_tile(tile, side))
+        pic.paste(color, (origin + dx, origin + dy), mask)
+
+def get_stamp_tiles(shape, unit_size):
+    """
+    Get the stamp of a module shape split into tiles of one module, drawn once and cached across requests
+    The stamp covers unit_size + 1 pixels in each direction, so it overlaps the next module by one pixel:
+    the overlapping column, row and corner pixel become separate tiles pasted one module further.
+    The stamp is a mask, so it does not depend on the module color.
+    
+    shape: Module shape, 'circle' or 'diamond'
+    unit_size: Size of each module in pixels
+    return: List of ((dx, dy) paste offset in pixels, unit_size x unit_size mask in mode '1'), empty tiles left out
+    """
+    key = (shape, unit_size)
+    if key not in _stamp_cache:
+        u = unit_size
+        
+        # Draw one module at the origin, exactly as it would be drawn on the image
+        stamp = Image.new('L', (u + 1, u + 1), 0)
+        draw = ImageDraw.Draw(stamp)
+        if shape == 'circle':
+            draw.ellipse([0, 0, u, u], fill=255)
+        else:
+            half_unit = u / 2
+            draw.polygon([(half_unit, 0), (u, half_unit), (half_unit, u), (0, half_unit)], fill=255)
+        
+        tiles = []
+        for offset, box in (((0, 0), (0, 0, u, u)),    # The module itself
+                            ((u, 0), (u, 0, u + 1, u)),  # Column overlapping the module on the right
+                            ((0, u), (0, u, u, u + 1)),  # Row overlapping the module below
+                            ((u, u), (u, u, u + 1, u + 1))):  # Corner pixel
+            part = stamp.crop(box)
+            if part.getbbox() is None:
+                continue
+            tile = Image.new('L', (u, u), 0)
+            tile.paste(part, (0, 0))
+            tiles.append((offset, tile.convert('1')))
+        _stamp_cache[key] = tiles
+    return _stamp_cache[key]
+
+def repeat_tile(tile, side):
+    """
+    Repeat a square tile over a square image, doubling the covered area with each paste
+    tile: PIL image
+    side: Size of the result in pixels, a multiple of the tile size
+    return: PIL image of side x side pixels
+    """
+    u = tile.size[0]
+    strip = Image.new(tile.mode, (side, u))
+    strip.paste(tile, (0, 0))
+    width = u
+    while width < side:
+        strip.paste(strip.crop((0, 0, width, u)), (width, 0))
+        width *= 2
+    
+    pattern = Image.new(tile.mode, (side, side))
+    pattern.paste(strip, (0, 0))
+    height = u
+    while height < side:
+        pattern.paste(pattern.crop((0, 0, side, height)), (0, height))
+        height *= 2
+    return pattern
+
+def module_mask(qrmatrix):
+    """
+    Build a one pixel per module mask of the QR matrix, dark modules are 255
+    qrmatrix: QR matrix (list matrix or matrix.BitMatrix)
+    return: PIL image in mode '1' (BitMatrix) or 'L' (list matrix)
+    """
+    size = len(qrmatrix)
+    
+    # BitMatrix rows are already bit-packed, column 0 first: left-align each row to whole bytes
+    if hasattr(qrmatrix, 'dark'):
+        width = (size + 7) // 8
+        pad = width * 8 - size
+        packed = b''.join((row << pad).to_bytes(width, 'big') for row in qrmatrix.dark)
+        return Image.frombytes('1', (size, size), packed)
+    
+    return Image.frombytes('L', (size, size), bytes(255 if cell else 0 for row in qrmatrix for cell in row))
+
+def dark_runs(qrmatrix):
+    """
+    Iterate over the horizontal runs of dark modules of a QR matrix, row by row from left to right
+    qrmatrix: QR matrix (list matrix or matrix.BitMatrix)
+    return: Generator of (y, x, length), the run covers columns x to x + length - 1
+    """
+    # BitMatrix: find each run of set bits in the row int, column 0 is the most significant bit
+    if hasattr(qrmatrix, 'dark'):
+        size = len(qrmatrix)
+        for y, row in enumerate(qrmatrix.dark):
+            while row:
+                high = row.bit_length() - 1
+                # Flipping the bits up to high turns the first light module after the run into the highest set bit
+                low = (row ^ ((1 << (high + 1)) - 1)).bit_length()
+                yield y, size - 1 - high, high - low + 1
+                row &= (1 << low) - 1
+        return
+    
+    for y, row in enumerate(qrmatrix):
+        x = 0
+        while x < len(row):
+            if row[x]:
+                start = x
+                while x < len(row) and row[x]:
+                    x += 1
+                yield y, start, x - start
+            else:
+                x += 1
+
+def dark_modules(qrmatrix):
+    """
+    Iterate over the dark modules of a QR matrix, row by row from left to right
+    qrmatrix: QR matrix (list matrix or matrix.BitMatrix)
+    return: Generator of (y, x) coordinates
+    """
+    # BitMatrix: read the set bits of each row int directly, column 0 is the most significant bit
+    if hasattr(qrmatrix, 'dark'):
+        size = len(qrmatrix)
+        for y, row in enumerate(qrmatrix.dark):
+            while row:
+                b = row.bit_length() - 1
+                yield y, size - 1 - b
+                row ^= 1 << b
+        return
+    
+    for y, row in enumerate(qrmatrix):
+        for x, cell in enumerate(row):
+            if cell:
+                yield y, x
\ No newline at end of file
@@ -0,0 +1,47 @@
+# QR Code Lazy Import Module: Defers loading heavy modules (NumPy, PIL) until their first use
+
+import importlib
+import importlib.util
+import sys
+
+class LazyModule:
+    """
+    Stand-in for a module that is imported on the first attribute access
+    name: Full module name, e.g. 'PIL.Image'
+
+    Usage:
+        Image = LazyModule('PIL.Image')  # Nothing is imported yet
+        Image.new(...)                   # Imports PIL.Image now, later accesses are plain attribute lookups
+
+    The import goes through importlib, so it is thread-safe and the module is shared with normal imports.
+    """
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+
+    def __getattr__(self, attr):
+        # Only called for attributes not copied yet: load the module, then keep the attribute on the stand-in
+        value = getattr(importlib.import_module(self._name), attr)
+        self.__dict__[attr] = value
+        return value
+
+    def __repr__(self):
+        return f'<lazy module {self._name!r}>'
+
+def lazy_module(name):
+    """
+    Get a module that is imported on first use, or the module itself when it is already imported
+    name: Full module name
+    return: Module or LazyModule
+    """
+    return sys.modules.get(name) or LazyModule(name)
+
+def optional_module(name):
+    """
+    Get an optional dependency that is imported on first use
+    Only the installation is checked now, which is much faster than importing the module
+    name: Top-level module name, e.g. 'numpy'
+    return: Module or LazyModule, None when the module is not installed
+    """
+    if importlib.util.find_spec(name) is None:
+        return None
+    return lazy_module(name)
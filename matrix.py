@@ -1,42 +1,168 @@
 # QR Code Matrix Generation Module: Responsible for constructing the 2D matrix structure of QR code
      
 from constant import alig_location, format_info_str, version_info_str, lindex
+import time
+import metrics
+from lazyimport import optional_module
+
+# Optional: enables the vectorized mask scoring engine, imported on first use
+np = optional_module('numpy')
+
+# Function pattern templates per version, built on first use: {ver: (template, data_order)}
+_template_cache = {}
+
+# Mask planes per version, built on first use: {ver: 8 tuples of row ints, data area only}
+_mask_plane_cache = {}
+
+class BitMatrix:
+    """
+    Compact QR matrix: every row is a Python int, column 0 is the most significant bit
+    size: Number of modules per side
+    
+    dark: Row bit masks of dark modules
+    function: Row bit masks of function patterns and reserved areas (the list matrix uses fixed values there)
+    filled: Whether data bits have been placed, before that every non-function module reads as None
     
-def get_qrmatrix(ver, ecl, bits):
+    m[row][column] reads and writes single modules like the list matrix, so the add_* functions work on
+    both. Writing a module marks it as a function module, data modules are only written by place_bits.
+    """
+    def __init__(self, size):
+        self.size = size
+        self.dark = [0] * size
+        self.function = [0] * size
+        self.filled = False
+    
+    def copy(self):
+        """
+        Copy the matrix
+        return: New BitMatrix with the same modules
+        """
+        m = BitMatrix(self.size)
+        m.dark = self.dark[:]
+        m.function = self.function[:]
+        m.filled = self.filled
+        return m
+    
+    def get(self, row, column):
+        """
+        Read one module
+        return: 1 (dark), 0 (light) or None (data module not filled yet)
+        """
+        bit = 1 << (self.size - 1 - column)
+        if not self.filled and not self.function[row] & bit:
+            return None
+        return 1 if self.dark[row] & bit else 0
+    
+    def set(self, row, column, value):
+        """
+        Write one function module
+        value: 1 (dark) or 0 (light)
+        """
+        bit = 1 << (self.size - 1 - column)
+        self.function[row] |= bit
+        if value:
+            self.dark[row] |= bit
+        else:
+            self.dark[row] &= ~bit
+    
+    def to_list(self):
+        """
+        Convert to the list matrix
+        return: list[list[int|None]]
+        """
+        return [row[:] for row in self]
+    
+    def __len__(self):
+        return self.size
+    
+    def __getitem__(self, row):
+        if row < 0:
+            row += self.size
+        if not 0 <= row < self.size:
+            raise IndexError('row index out of range')
+        return _BitRow(self, row)
+    
+    def __iter__(self):
+        return (_BitRow(self, row) for row in range(self.size))
+
+class _BitRow:
+    """
+    View of one BitMatrix row, supports negative indices and slices like a list row
+    """
+    def __init__(self, m, row):
+        self.m = m
+        self.row = row
+    
+    def _column(self, column):
+        if column < 0:
+            column += self.m.size
+        if not 0 <= column < self.m.size:
+            raise IndexError('column index out of range')
+        return column
+    
+    def __len__(self):
+        return self.m.size
+    
+    def __getitem__(self, column):
+        if isinstance(column, slice):
+            return [self.m.get(self.row, c) for c in range(*column.indices(self.m.size))]
+        return self.m.get(self.row, self._column(column))
+    
+    def __setitem__(self, column, value):
+        self.m.set(self.row, self._column(column), value)
+    
+    def __iter__(self):
+        return (self.m.get(self.row, c) for c in range(self.m.size))
+    
+def get_qrmatrix(ver, ecl, bits, observer=None):
     """
     Generate QR matrix
     ver: QR code version (1-40)
     ecl: Error correction level (L/M/Q/H)
     bits: Final data
+    observer: Optional function called as observer(stage, snapshot, **info) after each construction stage, with
+              stage 'finder' (finder patterns and separators), 'function' (all function patterns),
+              'data' (data bits placed), 'mask' (best mask applied, info mask_num) and 'final' (format and version added).
+              snapshot is a copy of the matrix, so it can be kept. Without an observer no copies are made.
     return: QR matrix
     """
 
-    # 1. Initialize matrix
-    qrmatrix = initialize_qrmatrix(ver)
-
-    # 2. Add finder patterns and separators
-    add_finder_and_separator(qrmatrix)
-    
-    # 3. Add alignment patterns
-    add_alignment(ver, qrmatrix)
-    
-    # 4. Add timing patterns
-    add_timing(qrmatrix)
+    start = time.perf_counter()
     
-    # 5. Add dark module and reserved areas
-    add_dark_and_reserving(ver, qrmatrix)
+    # 1-5. Finder patterns, separators, alignment, timing, dark module and reserved areas
+    # are the same for every code of a version, so they come from the cached template
+    qrmatrix = get_template(ver)
+    if observer is not None:
+        # The cached template already contains all function patterns, rebuild the first stage for the observer only
+        finder = initialize_qrmatrix(ver)
+        add_finder_and_separator(finder)
+        observer('finder', finder)
+        observer('function', qrmatrix.copy())
     
     # Copy matrix as mask base
-    maskmatrix = [i[:] for i in qrmatrix]
+    maskmatrix = qrmatrix.copy()
     
     # 6. Place data bits
     place_bits(bits, qrmatrix)
+    if observer is not None:
+        observer('data', qrmatrix.copy())
     
     # 7. Apply data mask
+    mask_start = time.perf_counter()
     mask_num, qrmatrix = mask(maskmatrix, qrmatrix)
+    mask_end = metrics.observe_stage('mask_selection', ver, ecl, mask_start)
+    if observer is not None:
+        observer('mask', qrmatrix.copy(), mask_num=mask_num)
     
     # 8. Add format information and version information
     add_format_and_version_string(ver, ecl, mask_num, qrmatrix)
+    if observer is not None:
+        observer('final', qrmatrix.copy(), mask_num=mask_num)
+    
+    # Matrix build time is everything except the mask selection
+    metrics.stage_seconds.observe(
+        (mask_start - start) + (time.perf_counter() - mask_end), stage='matrix_build', version=ver, ecl=ecl
+    )
 
     return qrmatrix
 
@@ -44,12 +170,48 @@ def initialize_qrmatrix(ver):
     """
     Initialize QR matrix
     ver: QR code version (1-40)
-    return: Initialized QR matrix
+    return: Initialized QR matrix (BitMatrix)
     """
     # Calculate QR code size
     num = (ver - 1) * 4 + 21
-    # Create an empty matrix, all elements are None
-    return [[None] * num for i in range(num)]
+    # Create an empty matrix, all elements read as None
+    return BitMatrix(num)
+
+def get_template(ver):
+    """
+    Get the function pattern template of a version (steps 1-5 of get_qrmatrix)
+    The template of each version is built once on first use, later calls only copy it
+    ver: QR code version (1-40)
+    return: Copy of the template (BitMatrix)
+    """
+    if ver not in _template_cache:
+        template = initialize_qrmatrix(ver)
+        add_finder_and_separator(template)
+        add_alignment(ver, template)
+        add_timing(template)
+        add_dark_and_reserving(ver, template)
+        _template_cache[ver] = (template, get_data_order(template))
+    return _template_cache[ver][0].copy()
+
+def get_data_order(m):
+    """
+    Get the order in which place_bits fills the data modules
+    m: QR matrix (BitMatrix) containing only function modules
+    return: Tuple of (row, column bit) pairs, one per data module
+    """
+    size = m.size
+    order = []
+    up = True
+    for a in range(size-1, 0, -2):
+        a = a-1 if a <= 6 else a
+        irange = range(size-1, -1, -1) if up else range(size)
+        for i in irange:
+            for j in (a, a-1):
+                b = 1 << (size - 1 - j)
+                if not m.function[i] & b:
+                    order.append((i, b))
+        up = not up
+    return tuple(order)
 
 def add_finder_and_separator(m):             
     """
@@ -132,6 +294,9 @@ def place_bits(bits, m):
     bits: Final data
     m: QR matrix
     """
+    if isinstance(m, BitMatrix):
+        return place_bits_compact(bits, m)
+    
     bit = (int(i) for i in bits)
 
     # Data filling direction, starting from bottom right, alternating upward/downward snake pattern
@@ -148,6 +313,28 @@ def place_bits(bits, m):
                     
         # Change direction after processing two columns (up becomes down, down becomes up)
         up = not up
+
+def place_bits_compact(bits, m):
+    """
+    Place data bits into a BitMatrix, same order as place_bits
+    bits: Final data
+    m: QR matrix (BitMatrix)
+    """
+    # Reuse the cached traversal order when m has the function modules of its version template
+    ver = (m.size - 17) // 4
+    cached = _template_cache.get(ver)
+    if cached is not None and cached[0].function == m.function:
+        order = cached[1]
+    else:
+        order = get_data_order(m)
+    
+    dark = m.dark[:]
+    for (i, b), bit in zip(order, map(int, bits)):
+        if bit:
+            dark[i] |= b
+    
+    m.dark = dark
+    m.filled = True
   
 def mask(mm_base, data_matrix_to_be_masked):
     """
@@ -156,15 +343,17 @@ def mask(mm_base, data_matrix_to_be_masked):
     data_matrix_to_be_masked: Matrix with data already filled, mask will be applied to this matrix (usually the state at the end of step 3)
     return: (Index of best mask, Data matrix with best mask applied)
     """
+    if isinstance(data_matrix_to_be_masked, BitMatrix):
+        return mask_compact(mm_base, data_matrix_to_be_masked)
+    
     # Ensure mm_base is not modified, create a copy
     mm_copy = [row[:] for row in mm_base]
     
     # Get 8 mask patterns
     mask_patterns = get_mask_patterns(mm_copy) # get_mask_patterns should also ensure not to modify its input
     
-    # Store score and masked matrix for each mask pattern
-    scores = []
-    masked_data_matrices = []
+    # Keep only the best masked matrix found so far
+    best_mask_index, best_score, best_matrix = None, None, None
 
     # Try each mask pattern
     for i in range(len(mask_patterns)):
@@ -181,13 +370,33 @@ def mask(mm_base, data_matrix_to_be_masked):
                          # Apply mask using XOR operation
                          current_masked_data[r][c] = current_masked_data[r][c] ^ pattern[r][c]
         
-        # Calculate score for this mask pattern
-        scores.append(compute_score(current_masked_data))
-        masked_data_matrices.append(current_masked_data)
+        # Calculate score for this mask pattern, the first mask with the lowest (best) score wins
+        score = score_candidate(current_masked_data)
+        if best_score is None or score < best_score:
+            best_mask_index, best_score, best_matrix = i, score, current_masked_data
+    
+    return best_mask_index, best_matrix
+
+def mask_compact(mm_base, data_matrix_to_be_masked):
+    """
+    Data masking for BitMatrix, every mask is a row-wise XOR
+    mm_base: Base matrix for generating mask patterns (BitMatrix, only its function modules are used)
+    data_matrix_to_be_masked: Matrix with data already filled (BitMatrix)
+    return: (Index of best mask, Data matrix with best mask applied)
+    """
+    data_rows = data_matrix_to_be_masked.dark
+    
+    # One candidate matrix is reused for all 8 masks, only the rows of the best one are kept
+    candidate = data_matrix_to_be_masked.copy()
+    best_mask_index, best_score, best_rows = None, None, None
+    for i, plane in enumerate(get_mask_planes(mm_base)):
+        candidate.dark = [d ^ p for d, p in zip(data_rows, plane)]
+        score = score_candidate(candidate)
+        if best_score is None or score < best_score:
+            best_mask_index, best_score, best_rows = i, score, candidate.dark
     
-    # Select mask with lowest (best) score
-    best_mask_index = scores.index(min(scores))
-    return best_mask_index, masked_data_matrices[best_mask_index]
+    candidate.dark = best_rows
+    return best_mask_index, candidate
     
 def get_mask_patterns(mm_input):
     """
@@ -196,7 +405,11 @@ def get_mask_patterns(mm_input):
               This function should not modify mm_input.
     return: List of 8 mask patterns, each pattern same size as mm_input,
              with 0 or 1 calculated according to mask formula only at positions where mm_input is None (data area).
+             For a BitMatrix input each pattern is a BitMatrix whose dark modules are the masked data modules.
     """
+    if isinstance(mm_input, BitMatrix):
+        return get_mask_patterns_compact(mm_input)
+    
     mm = [row[:] for row in mm_input]
 
     # Create mask template, marking data area and functional area
@@ -208,31 +421,6 @@ def get_mask_patterns(mm_input):
                 data_area_mask_template[r][c] = None  # Mark as position needing mask value calculation
             # Functional areas remain 0 in data_area_mask_template
 
-    # Define 8 mask formulas
-    def formula(i, row, column):
-        """
-        Implement 8 mask formulas defined in QR code standard
-        i: Mask pattern index (0-7)
-        row, column: Module coordinates
-        return: Whether the coordinate needs to be set to 1
-        """
-        if i == 0:  # (row + column) mod 2 == 0
-            return (row + column) % 2 == 0
-        elif i == 1:
-            return row % 2 == 0
-        elif i == 2:
-            return column % 3 == 0
-        elif i == 3:
-            return (row + column) % 3 == 0
-        elif i == 4:
-            return (row // 2 + column // 3) % 2 == 0
-        elif i == 5:
-            return ((row * column) % 2) + ((row * column) % 3) == 0
-        elif i == 6:
-            return (((row * column) % 2) + ((row * column) % 3)) % 2 == 0
-        elif i == 7:
-            return     (((row + column) % 2) + ((row * column) % 3)) % 2 == 0
-
     # Generate 8 mask patterns
     mask_patterns_list = []
     for i in range(8):
@@ -249,13 +437,152 @@ def get_mask_patterns(mm_input):
         mask_patterns_list.append(pattern)
         
     return mask_patterns_list
+
+def get_mask_patterns_compact(mm_input):
+    """
+    Get mask patterns for a BitMatrix
+    mm_input: Base QR matrix (BitMatrix), only its function modules are used
+    return: List of 8 BitMatrix patterns, dark only where the mask formula is 1 in the data area
+    """
+    mask_patterns_list = []
+    for plane in get_mask_planes(mm_input):
+        pattern = mm_input.copy()
+        pattern.filled = True
+        pattern.dark = list(plane)
+        mask_patterns_list.append(pattern)
+    return mask_patterns_list
+
+def get_mask_planes(mm_input):
+    """
+    Get the 8 mask planes of a BitMatrix, restricted to its data area
+    Planes of a version template are computed once and cached
+    mm_input: Base QR matrix (BitMatrix), only its function modules are used
+    return: Tuple of 8 tuples of row ints, bit set where the mask flips a data module
+    """
+    ver = (mm_input.size - 17) // 4
+    cached = _template_cache.get(ver)
+    is_template = cached is not None and cached[0].function == mm_input.function
+    if is_template and ver in _mask_plane_cache:
+        return _mask_plane_cache[ver]
+    
+    size = mm_input.size
+    planes = []
+    for i in range(8):
+        plane = []
+        for r in range(size):
+            row = 0
+            for c in range(size):
+                row = (row << 1) | (1 if formula(i, r, c) else 0)
+            plane.append(row & ~mm_input.function[r])
+        planes.append(tuple(plane))
+    planes = tuple(planes)
+    
+    if is_template:
+        _mask_plane_cache[ver] = planes
+    return planes
+
+def formula(i, row, column):
+    """
+    Implement 8 mask formulas defined in QR code standard
+    i: Mask pattern index (0-7)
+    row, column: Module coordinates
+    return: Whether the coordinate needs to be set to 1
+    """
+    if i == 0:  # (row + column) mod 2 == 0
+        return (row + column) % 2 == 0
+    elif i == 1:
+        return row % 2 == 0
+    elif i == 2:
+        return column % 3 == 0
+    elif i == 3:
+        return (row + column) % 3 == 0
+    elif i == 4:
+        return (row // 2 + column // 3) % 2 == 0
+    elif i == 5:
+        return ((row * column) % 2) + ((row * column) % 3) == 0
+    elif i == 6:
+        return (((row * column) % 2) + ((row * column) % 3)) % 2 == 0
+    elif i == 7:
+        return     (((row + column) % 2) + ((row * column) % 3)) % 2 == 0
+            
+def score_candidate(m):
+    """
+    Calculate the score of one masked candidate
+    m: QR matrix (list matrix or BitMatrix)
+    return: Total score, same as compute_score
+    """
+    # Use the vectorized engine when NumPy is installed, it gives exactly the same scores
+    if np is not None:
+        return compute_scores_numpy([m])[0]
+    return compute_score(m)
+
+def compute_scores_numpy(candidates):
+    """
+    Calculate the scores of all candidates at once with NumPy (same rules as compute_score)
+    candidates: List of masked QR matrices of the same size
+    return: List of scores, same order as candidates
+    """
+    a = _stack_candidates(candidates)  # Shape (k, n, n)
+    k, n = a.shape[0], a.shape[1]
+    
+    # Rows of every candidate followed by its columns, shape (k * 2n, n)
+    lines = np.concatenate((a, a.transpose(0, 2, 1)), axis=1).reshape(k * 2 * n, n)
+    owner = np.arange(k * 2 * n) // (2 * n)  # Candidate index of each line
+    
+    # Evaluation criterion 1: runs of 5 or more same color modules, each costs (length - 2)
+    edges = np.ones((len(lines), n + 1), dtype=bool)
+    edges[:, 1:-1] = lines[:, 1:] != lines[:, :-1]
+    line_idx, pos = np.nonzero(edges)  # Run boundaries, ordered line by line
+    length = pos[1:] - pos[:-1]
+    long_run = (line_idx[1:] == line_idx[:-1]) & (length >= 5)
+    score1 = np.bincount(owner[line_idx[1:][long_run]], weights=length[long_run] - 2, minlength=k)
+    
+    # Evaluation criterion 2: 2×2 same color blocks, each costs 3
+    top_left = a[:, :-1, :-1]
+    block = (top_left == a[:, 1:, :-1]) & (top_left == a[:, :-1, 1:]) & (top_left == a[:, 1:, 1:])
+    score2 = 3 * block.sum(axis=(1, 2))
+    
+    # Evaluation criterion 3: finder-like patterns, every occurrence costs 40
+    # Read each 11 module window as an 11 bit integer and compare with both patterns
+    window = np.zeros((len(lines), n - 10), dtype=np.int32)
+    for j in range(11):
+        window = (window << 1) | lines[:, j:n - 10 + j]
+    found = (window == 0b10111010000) | (window == 0b00001011101)
+    score3 = 40 * np.bincount(owner, weights=found.sum(axis=1), minlength=k)
+    
+    # Evaluation criterion 4: dark module ratio, computed exactly like evaluation4
+    scores = []
+    for i, darknum in enumerate(a.sum(axis=(1, 2)).tolist()):
+        percent = darknum / (n**2) * 100
+        s = int((50 - percent) / 5) * 5
+        score4 = 2*s if s >= 0 else -2*s
+        scores.append(int(score1[i]) + int(score2[i]) + int(score3[i]) + score4)
+    return scores
             
+def _stack_candidates(candidates):
+    """
+    Stack candidates into one uint8 array of shape (k, n, n)
+    candidates: List of list matrices or BitMatrix objects
+    """
+    if not isinstance(candidates[0], BitMatrix):
+        return np.array(candidates, dtype=np.uint8)
+    # Unpack the row ints: left align every row to whole bytes, then unpack to one module per byte
+    n = candidates[0].size
+    width = (n + 7) // 8
+    pad = width * 8 - n
+    packed = b''.join((row << pad).to_bytes(width, 'big') for m in candidates for row in m.dark)
+    bits = np.unpackbits(np.frombuffer(packed, dtype=np.uint8))
+    return bits.reshape(len(candidates), n, width * 8)[:, :, :n]
+
 def compute_score(m):
     """
     Calculate mask pattern score (lower is better)
     m: QR matrix
     return: Total score (sum of four evaluation criteria)
     """
+    if isinstance(m, BitMatrix):
+        m = m.to_list()
+    
     def evaluation1(m):
         """
         Evaluation criterion 1: Same color consecutive modules in row/column
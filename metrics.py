@@ -0,0 +1,227 @@
+# QR Code Metrics Module: In-process counters, gauges and latency histograms exported in the Prometheus text format
+
+import logging
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Fraction of debug/info log records that are written, warnings and errors are always written
+LOG_SAMPLE_RATE = float(os.environ.get('QR_LOG_SAMPLE_RATE', '0.01'))
+
+# Upper bounds of the latency histogram buckets in seconds, from 50 microseconds to 5 seconds
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+# All metrics in creation order, exported by render()
+_registry = []
+
+# Histogram observations recorded by capture(), None when nothing is being captured
+_captured = None
+
+class _Metric:
+    """
+    Common part of all metrics: name, help text, label names and a lock
+    """
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        """Label values in the order of labelnames"""
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key, extra=''):
+        """Format label values as {name="value",...}"""
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, key)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def render(self):
+        """Lines of the metric in the Prometheus text format"""
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} {self.kind}'
+        yield from self._samples()
+
+class Counter(_Metric):
+    """
+    Monotonically increasing count, one value per label combination
+
+    Usage:
+        requests = Counter('qr_requests_total', 'Requests', ('endpoint',))
+        requests.inc(endpoint='/generate')
+    """
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f'{self.name}{self._labels(key)} {_format(value)}'
+
+class Gauge(Counter):
+    """
+    Value that goes up and down, one value per label combination
+
+    Usage:
+        in_flight = Gauge('qr_in_flight', 'Requests being served', ('endpoint',))
+        in_flight.inc(endpoint='/generate')
+        in_flight.dec(endpoint='/generate')
+    """
+    kind = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values in cumulative buckets, with their sum and count
+
+    Usage:
+        latency = Histogram('qr_latency_seconds', 'Latency', ('stage',))
+        latency.observe(0.002, stage='render')
+        with latency.time(stage='render'):
+            ...
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # label values -> [count per bucket (last one is +Inf), sum]
+
+    def observe(self, value, **labels):
+        if _captured is not None:
+            _captured.append((self.name, value, labels))
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the time spent in the with block, also when it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        with self._lock:
+            values = sorted((key, (counts[:], total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = 'le="' + _format(bound) + '"'
+                yield f'{self.name}_bucket{self._labels(key, le)} {cumulative}'
+            yield f'{self.name}_sum{self._labels(key)} {_format(total)}'
+            yield f'{self.name}_count{self._labels(key)} {cumulative}'
+
+class Collector(_Metric):
+    """
+    Metric read from a callback when it is exported, for values kept elsewhere (e.g. cache statistics)
+    callback: Function returning a list of (label values dict, value)
+    kind: 'counter' or 'gauge'
+    """
+    def __init__(self, name, help, labelnames, callback, kind='gauge'):
+        super().__init__(name, help, labelnames)
+        self.callback = callback
+        self.kind = kind
+
+    def _samples(self):
+        for labels, value in self.callback():
+            yield f'{self.name}{self._labels(self._key(labels))} {_format(value)}'
+
+# Time spent in each stage of QR code generation
+stage_seconds = Histogram(
+    'qr_stage_duration_seconds',
+    'Time spent in each QR code generation stage',
+    ('stage', 'version', 'ecl')
+)
+
+def observe_stage(stage, ver, ecl, start):
+    """
+    Record the duration of a generation stage that started at start (time.perf_counter())
+    The version is only known after data encoding, so stages are timed first and labeled afterwards
+    stage: 'data_encode', 'ecc', 'structure', 'matrix_build', 'mask_selection', 'render', 'verify' or 'png_encode'
+    return: time.perf_counter() at the end, the start of the next stage
+    """
+    end = time.perf_counter()
+    stage_seconds.observe(end - start, stage=stage, version=ver, ecl=ecl)
+    return end
+
+def render():
+    """
+    Export all metrics
+    return: Text in the Prometheus exposition format (version 0.0.4)
+    """
+    return '\n'.join(line for metric in _registry for line in metric.render()) + '\n'
+
+@contextmanager
+def capture():
+    """
+    Also record the histogram observations made in the with block, so that a worker process
+    can send them back to the process that exports the metrics
+    return: List of (metric name, value, labels), filled while the block runs
+    """
+    global _captured
+    previous, _captured = _captured, []
+    try:
+        yield _captured
+    finally:
+        _captured = previous
+
+def replay(observations):
+    """
+    Add histogram observations recorded by capture() in another process
+    """
+    histograms = {metric.name: metric for metric in _registry if isinstance(metric, Histogram)}
+    for name, value, labels in observations:
+        histograms[name].observe(value, **labels)
+
+def log_sampled(logger, level, msg, *args):
+    """
+    Log a record at a level below WARNING for only a sample of the calls (QR_LOG_SAMPLE_RATE),
+    so that per-request diagnostics do not flood the log. WARNING and above are always logged.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if level >= logging.WARNING or random.random() < LOG_SAMPLE_RATE:
+        logger.log(level, msg, *args)
+
+def _format(value):
+    """Format a sample value"""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def _escape(value):
+    """Escape a label value"""
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
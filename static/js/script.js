@@ -314,6 +314,51 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
     
+    // Paint the compact step payload of /get_qr_steps (format 'delta') into one image per step
+    // The first step is a bitset of the whole matrix, later steps are a bitset or runs of changed modules
+    function paintDeltaSteps(data) {
+        const size = data.size;
+        const scale = 10; // Pixels per module, same as the server-rendered step images
+        const modules = new Uint8Array(size * size); // 1 = dark, row by row
+        
+        const canvas = document.createElement('canvas');
+        canvas.width = canvas.height = size * scale;
+        const context = canvas.getContext('2d');
+        
+        return data.steps.map(step => {
+            if (step.bits) {
+                // Bitset: row by row, most significant bit first
+                const bytes = atob(step.bits);
+                for (let i = 0; i < modules.length; i++) {
+                    modules[i] = (bytes.charCodeAt(i >> 3) >> (7 - (i & 7))) & 1;
+                }
+            } else {
+                // Runs [row, column, length, ...] of modules that changed since the previous step
+                const runs = step.runs;
+                for (let r = 0; r < runs.length; r += 3) {
+                    const start = runs[r] * size + runs[r + 1];
+                    for (let i = start; i < start + runs[r + 2]; i++) {
+                        modules[i] ^= 1;
+                    }
+                }
+            }
+            
+            // White background, black dark modules
+            context.fillStyle = '#ffffff';
+            context.fillRect(0, 0, canvas.width, canvas.height);
+            context.fillStyle = '#000000';
+            for (let y = 0; y < size; y++) {
+                for (let x = 0; x < size; x++) {
+                    if (modules[y * size + x]) {
+                        context.fillRect(x * scale, y * scale, scale, scale);
+                    }
+                }
+            }
+            
+            return {image: canvas.toDataURL('image/png'), description: step.description};
+        });
+    }
+    
     // Get QR code creation steps
     function getQRSteps(content, ecl, version) {
         // Show loading
@@ -324,6 +369,7 @@ document.addEventListener('DOMContentLoaded', function() {
         formData.append('content', content);
         formData.append('ecl', ecl);
         formData.append('version', version);
+        formData.append('format', 'delta'); // Compact step payload, painted below
         
         // Send request
         fetch('/get_qr_steps', {
@@ -335,7 +381,7 @@ document.addEventListener('DOMContentLoaded', function() {
             document.getElementById('loading-spinner').style.display = 'none';
             
             if (data.success) {
-                qrSteps = data.steps;
+                qrSteps = data.format === 'delta' ? paintDeltaSteps(data) : data.steps;
                 
                 // Show modal and display first step
                 stepsModal.classList.add('show');
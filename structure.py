@@ -1,6 +1,7 @@
 # QR Code Structure Module: Handles interleaving of data codewords and error correction codewords, generating the final binary bit stream
 
 from constant import required_remainder_bits, lindex, grouping_list
+from bitbuffer import BitBuffer
 
 def structure_final_bits(ver, ecl, data_codewords, ecc):
     """
@@ -9,12 +10,14 @@ def structure_final_bits(ver, ecl, data_codewords, ecc):
     ecl: Error correction level (L/M/Q/H)
     data_codewords: List of data codewords
     ecc: List of error correction codewords
-    return: Final binary bit stream string
+    return: Final binary bit stream (BitBuffer)
     """
     final_message = interleave_dc(ver, ecl, data_codewords) + interleave_ecc(ecc)
     
-    # Convert to binary and add remainder bits
-    final_bits = ''.join(['0'*(8-len(i))+i for i in [bin(i)[2:] for i in final_message]]) + '0' * required_remainder_bits[ver-1]
+    # Pack the codewords and add remainder bits
+    final_bits = BitBuffer()
+    final_bits.append_bytes(final_message)
+    final_bits.append(0, required_remainder_bits[ver-1])
     
     return final_bits
 
@@ -1,9 +1,33 @@
 # QR Code Generation Module: Integrates various components to generate complete QR codes
 
-import data, ECC, structure, matrix, draw  # Import modules required for QR code generation
+import data, ECC, structure, matrix, draw, vector  # Import modules required for QR code generation
+import metrics
+import verifier
+import time
 import base64
-from PIL import Image  # For image processing
+from bitbuffer import BitBuffer
 import io
+import os
+import threading
+from collections import deque
+import concurrent.futures  # Worker processes are only loaded when generate_many or a large set uses them
+from concurrent.futures import wait, FIRST_COMPLETED
+from lazyimport import lazy_module
+
+# Version of the symbols of a Structured Append set when none is given, 97 modules per side
+STRUCTURED_APPEND_VERSION = 20
+
+# Structured Append sets with fewer modules in total are generated in the calling process: below this size
+# (about 60 ms of work) handing the symbols to worker processes costs more than it saves
+SET_PARALLEL_MODULES = 100000
+
+# Worker processes for large Structured Append sets, started on first use and kept: (workers, executor)
+_set_pool = None
+_set_pool_lock = threading.Lock()
+
+# For image processing, PIL is imported on first use
+Image = lazy_module('PIL.Image')
+ImageColor = lazy_module('PIL.ImageColor')
 
 def get_qrcode(ver, ecl, str, save_place, **kwargs):
     """
@@ -22,22 +46,326 @@ def get_qrcode(ver, ecl, str, save_place, **kwargs):
     margin: Margin, default 4
     frame: Whether to add a frame, default True
     filter_name: Image filter, options 'none', 'edge_enhance', 'smooth', default 'none'
+    color_mode: 'auto' (two-color 1-bit PNG unless a filter is used) or 'rgb' (24-bit PNG), default 'auto'
+    compress_level: PNG zlib compression level 0-9, default 6
+    optimize: Whether to search for the smallest PNG encoding, default False
+    
+    return: (Version actually used, path of the saved PNG file)
     """
+    ver, png = get_qrcode_bytes(ver, ecl, str, **kwargs)
+    
+    # Save with a content-addressed file name
+    return ver, draw.save_qrcode(save_place, png)
 
-    # Data encoding
-    ver, data_codewords = data.encode(ver, ecl, str)
+def get_qrcode_bytes(ver, ecl, str, verify=False, structured_append=None, **kwargs):
+    """
+    Generate QR code as PNG bytes in memory, without writing any file
+    ver, ecl, str, kwargs: Same as get_qrcode
+    verify: True to decode the rendered image and raise verifier.VerificationError unless it holds str
+    structured_append: Optional Structured Append header, see make_qrmatrix
+    return: (Version actually used, PNG file content)
+    """
+    ver, qrmatrix = make_qrmatrix(ver, ecl, str, structured_append=structured_append)
+    
+    # Draw QR code, passing custom parameters
+    start = time.perf_counter()
+    pic = draw.render_qrcode(qrmatrix, **kwargs)
+    start = metrics.observe_stage('render', ver, ecl, start)
+    if verify:
+        # Images of one pixel per module cannot be read back, their matrix is checked instead
+        if kwargs.get('unit_size', 3) >= 2:
+            verifier.verify_image(pic, str, ver=ver, ecl=ecl, structured_append=structured_append, **kwargs)
+        else:
+            verifier.verify(qrmatrix, str, ver=ver, ecl=ecl, structured_append=structured_append)
+        start = metrics.observe_stage('verify', ver, ecl, start)
+    png = draw.encode_png(pic, **kwargs)
+    metrics.observe_stage('png_encode', ver, ecl, start)
+    return ver, png
 
+def get_qrcode_vector(ver, ecl, str, format='svg', **kwargs):
+    """
+    Generate QR code as a vector document (SVG or PDF)
+    ver, ecl, str, kwargs: Same as get_qrcode, filter_name is ignored
+    format: 'svg' or 'pdf'
+    return: (Version actually used, generator of bytes chunks of the document)
+    """
+    ver, qrmatrix = make_qrmatrix(ver, ecl, str)
+    
+    # The document is produced while it is consumed, its size only depends on the number of modules
+    return ver, vector.vector_qrcode(qrmatrix, format, **kwargs)
+
+def make_qrmatrix(ver, ecl, str, observer=None, structured_append=None):
+    """
+    Run the encoding pipeline up to the finished QR matrix
+    ver: QR code version (1-40, 0 for automatic)
+    ecl: Error correction level (L/M/Q/H)
+    str: String to encode
+    observer: Optional stage observer, see matrix.get_qrmatrix
+    structured_append: Optional (symbol position, number of symbols, parity) header of a symbol of a set, see get_qrcode_set
+    return: (Version actually used, QR matrix)
+    """
+    # Data encoding, each stage is timed for the per-stage latency metrics
+    start = time.perf_counter()
+    ver, data_codewords = data.encode(ver, ecl, str, structured_append)
+    start = metrics.observe_stage('data_encode', ver, ecl, start)
+    
     # Error correction encoding
     ecc = ECC.encode(ver, ecl, data_codewords)
+    start = metrics.observe_stage('ecc', ver, ecl, start)
     
     # Structure final data
     final_bits = structure.structure_final_bits(ver, ecl, data_codewords, ecc)
+    metrics.observe_stage('structure', ver, ecl, start)
     
-    # Generate QR matrix
-    qrmatrix = matrix.get_qrmatrix(ver, ecl, final_bits)
+    # Generate QR matrix (matrix build and mask selection are timed in matrix.get_qrmatrix)
+    qrmatrix = matrix.get_qrmatrix(ver, ecl, final_bits, observer)
+    
+    return ver, qrmatrix
+
+def get_qrcode_set(ver, ecl, str, workers=None, verify=False, **kwargs):
+    """
+    Generate a Structured Append set: the content is split over up to 16 QR codes that scanners join again
+    ver: QR code version of every symbol (1-40, 0 for STRUCTURED_APPEND_VERSION)
+    ecl: Error correction level (L/M/Q/H)
+    str: String to encode
+    workers: Number of worker processes, 1 generates in the current process. By default sets smaller than
+             SET_PARALLEL_MODULES modules are generated in the current process, larger ones use os.cpu_count() workers
+    verify: True to decode every rendered image and check its part of the content and its header
+    kwargs: Custom parameters, same as get_qrcode
+    return: (Version of the symbols, list of PNG file contents in symbol order)
+    
+    Content too long for 16 symbols of the version raises ValueError, choose a higher version.
+    Smaller symbols are faster to generate and easier to scan than one large code.
+    """
+    ver = ver or STRUCTURED_APPEND_VERSION
+    parts = data.split(ver, ecl, str)
+    # One chunk per symbol so that every worker process takes a symbol
+    chunks = [
+        [(index, {'content': text, 'version': ver, 'ecl': ecl, 'structured_append': header, **kwargs})]
+        for index, (text, header) in enumerate(parts)
+    ]
+    verify_rate = 1 if verify else 0
+    
+    if workers is None:
+        workers = 1 if len(parts) * (4 * ver + 17) ** 2 < SET_PARALLEL_MODULES else os.cpu_count() or 1
+    if workers == 1 or len(chunks) == 1:
+        results = [result for chunk in chunks for result in _generate_chunk(chunk, verify_rate)]
+    else:
+        executor = _get_set_pool(workers)
+        results = [result for done in executor.map(_generate_chunk, chunks, [verify_rate] * len(chunks)) for result in done]
+    
+    images = []
+    for result in results:
+        if result['error'] is not None:
+            raise ValueError(f"Symbol {result['index'] + 1} of {len(parts)}: {result['error']}")
+        images.append(result['image'])
+    return ver, images
+
+def _get_set_pool(workers):
+    """
+    Get the long-lived worker processes of get_qrcode_set, so that only the first large set pays for starting them
+    workers: Number of worker processes, a pool of another size replaces the current one
+    return: concurrent.futures.ProcessPoolExecutor
+    """
+    global _set_pool
+    with _set_pool_lock:
+        if _set_pool is None or _set_pool[0] != workers:
+            if _set_pool is not None:
+                _set_pool[1].shutdown(wait=False)
+            _set_pool = (workers, concurrent.futures.ProcessPoolExecutor(max_workers=workers))
+        return _set_pool[1]
+
+def parse_options(values):
+    """
+    Read and validate the generation options of a request, invalid values fall back to the defaults
+    values: Dict-like source of options (request.form, a JSON object or a CSV row)
+    return: (version, ecl, custom appearance parameters for theqrmodule.get_qrcode)
+    """
+    # Get error correction level
+    ecl = values.get('ecl', 'L') # Default is L level
+    if ecl not in ['L', 'M', 'Q', 'H']:
+        ecl = 'L' 
+    
+    # Get version number, if not specified or invalid, version is automatically selected
+    try:
+        version = int(values.get('version', '0')) # 0 means auto-select version
+        if version < 0 or version > 40: # Version range 1-40, 0 means auto
+            version = 0 
+    except (ValueError, TypeError):
+        version = 0 
+    
+    # Get custom appearance parameters
+    foreground_color = values.get('foreground_color', 'black') # Foreground color
+    background_color = values.get('background_color', 'white') # Background color
+    module_shape = values.get('module_shape', 'square') # Module shape
+    if module_shape not in ['square', 'circle', 'diamond']:
+        module_shape = 'square' # Default is square
+        
+    # Get custom size and border parameters
+    try:
+        unit_size = int(values.get('unit_size', '3')) # Pixel size of each module
+        if unit_size < 1 or unit_size > 10:
+            unit_size = 3 
+    except (ValueError, TypeError):
+        unit_size = 3
+        
+    try:
+        border_size = int(values.get('border_size', '4')) # Border size (space from QR code to image edge)
+        if border_size < 0 or border_size > 10: # In draw.py this is actually quiet_zone
+            border_size = 4 
+    except (ValueError, TypeError):
+        border_size = 4
         
-    # Draw QR code and save, passing custom parameters
-    return ver, draw.draw_qrcode(save_place, qrmatrix, **kwargs)
+    try:
+        margin = int(values.get('margin', '4')) # Internal margin when drawing QR code
+        if margin < 0 or margin > 10:
+            margin = 4 
+    except (ValueError, TypeError):
+        margin = 4
+    
+    # Get whether to add extra frame (at drawing level)
+    frame = str(values.get('frame', 'true')).lower() == 'true'
+    
+    # Get image filter
+    filter_name = values.get('filter_name', 'none') # Image filter name
+    if filter_name not in ['none', 'blur', 'edge_enhance', 'smooth']:
+        filter_name = 'none' # Default is no filter
+    
+    # Get PNG output settings
+    color_mode = values.get('color_mode', 'auto') # Two-color image when the style allows it
+    if color_mode not in ['auto', 'rgb']:
+        color_mode = 'auto'
+    try:
+        compress_level = int(values.get('compress_level', '6')) # zlib compression level
+        if compress_level < 0 or compress_level > 9:
+            compress_level = 6
+    except (ValueError, TypeError):
+        compress_level = 6
+    optimize = str(values.get('optimize', 'false')).lower() == 'true'
+    
+    return version, ecl, {
+        'foreground_color': foreground_color,
+        'background_color': background_color,
+        'module_shape': module_shape,
+        'unit_size': unit_size,
+        'border_size': border_size, # This border_size corresponds to quiet_zone in draw.py
+        'margin': margin,           # This margin corresponds to margin in draw.py
+        'frame': frame,
+        'filter_name': filter_name,
+        'color_mode': color_mode,
+        'compress_level': compress_level,
+        'optimize': optimize
+    }
+
+def cache_key(ver, ecl, str, **kwargs):
+    """
+    Build a hashable key identifying the image get_qrcode produces for these parameters
+    Colors are normalized to RGB tuples, so for example 'black' and '#000000' share a key
+    ver, ecl, str, kwargs: Same as get_qrcode
+    return: Tuple
+    """
+    options = []
+    for name, value in sorted(kwargs.items()):
+        if name in ('foreground_color', 'background_color'):
+            try:
+                value = ImageColor.getcolor(value, 'RGB')
+            except (ValueError, AttributeError):
+                pass  # Left as given, drawing will report the invalid color
+        options.append((name, value))
+    return (ver, ecl, str, tuple(options))
+
+def generate_many(items, workers=None, chunksize=16, ordered=True, verify_rate=None):
+    """
+    Generate many QR codes in parallel worker processes
+    items: Iterable of items, each is a content string or a dict with 'content' and optional
+           'version' (default 0, automatic), 'ecl' (default 'L'), 'structured_append' and the custom parameters of get_qrcode
+    workers: Number of worker processes, default os.cpu_count(); 1 generates in the current process
+    chunksize: Number of items sent to a worker process at a time
+    ordered: True to yield results in input order, False to yield them as soon as they are done
+    verify_rate: Fraction of the items whose image is decoded and compared with the content,
+                 default QR_VERIFY_SAMPLE_RATE (0). An item that does not verify gets an error.
+    
+    Returns a generator of result dicts:
+    index: Position of the item in items
+    version: Version actually used (None on error)
+    image: PNG file content as bytes (None on error)
+    error: Error message, None on success. A failing item does not stop the batch.
+    
+    Items are read lazily, at most a few chunks per worker are in flight at any time.
+    Images are rendered in memory, no files are written.
+    """
+    workers = workers or os.cpu_count() or 1
+    chunks = _chunked(enumerate(items), chunksize)
+    
+    if workers == 1:
+        for chunk in chunks:
+            yield from _generate_chunk(chunk, verify_rate)
+        return
+    
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        max_pending = workers * 4
+        for chunk in chunks:
+            pending.append(executor.submit(_generate_chunk, chunk, verify_rate))
+            # Wait for results before reading more items once enough work is queued
+            while len(pending) >= max_pending:
+                yield from _collect(pending, ordered)
+        while pending:
+            yield from _collect(pending, ordered)
+
+def _chunked(iterable, size):
+    """
+    Split an iterable into lists of at most size elements
+    """
+    chunk = []
+    for i in iterable:
+        chunk.append(i)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _collect(pending, ordered):
+    """
+    Take finished chunks out of the pending futures and return their results
+    ordered: True to wait for the oldest chunk, False to take whichever chunks are done
+    """
+    if ordered:
+        return pending.popleft().result()
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    results = []
+    for future in done:
+        pending.remove(future)
+        results += future.result()
+    return results
+
+def _generate_chunk(chunk, verify_rate=None):
+    """
+    Generate the QR codes of one chunk, runs in a worker process
+    chunk: List of (index, item)
+    verify_rate: Fraction of the items to verify, see generate_many
+    return: List of result dicts, see generate_many
+    """
+    results = []
+    for index, item in chunk:
+        try:
+            if isinstance(item, str):
+                options = {'content': item}
+            elif isinstance(item, dict):
+                options = dict(item)
+            else:
+                raise ValueError('Item must be a string or an object')
+            if 'content' not in options:
+                raise ValueError('Please enter content')
+            content = options.pop('content')
+            ver = options.pop('version', 0)
+            ecl = options.pop('ecl', 'L')
+            ver, image = get_qrcode_bytes(ver, ecl, content, verify=verifier.should_verify(verify_rate), **options)
+            results.append({'index': index, 'version': ver, 'image': image, 'error': None})
+        except Exception as e:
+            results.append({'index': index, 'version': None, 'image': None, 'error': str(e)})
+    return results
 
 def _matrix_to_base64(matrix, scale=10):
     """
@@ -48,16 +376,9 @@ def _matrix_to_base64(matrix, scale=10):
     # Calculate image size
     size = len(matrix) * scale
     
-    # Create a new white image
-    img = Image.new('1', (size, size), 'white')
-    
-    # Draw QR matrix
-    for y, row in enumerate(matrix):
-        for x, cell in enumerate(row):
-            if cell:  # If it's a black module
-                for i in range(scale):
-                    for j in range(scale):
-                        img.putpixel((x * scale + i, y * scale + j), 0)
+    # One pixel per module (dark modules black, everything else white), scaled up in one step
+    img = draw.module_mask(matrix).convert('L').point(lambda value: 255 - value, '1')
+    img = img.resize((size, size), Image.NEAREST)
     
     # Convert image to base64
     buffer = io.BytesIO()
@@ -74,85 +395,85 @@ def get_qr_steps(ver, ecl, content):
     content: Content to encode
     
     Returns a list of steps, each step containing an image and description
+    Errors (e.g. content too long) are raised to the caller
+    """
+    return [
+        {
+            'image': _matrix_to_base64(snapshot),  # Convert matrix to Base64 image
+            'description': description
+        }
+        for snapshot, description in _qr_step_snapshots(ver, ecl, content)
+    ]
+
+def get_qr_steps_delta(ver, ecl, content):
+    """
+    Generate steps for QR code creation as a compact payload the browser paints itself, no images are rendered
+    ver, ecl, content: Same as get_qr_steps
+    
+    Returns a dict:
+    size: Number of modules per side
+    steps: List of steps, each step has 'description' and either
+           'bits': Base64 of the whole matrix as a bitset, row by row, most significant bit first, 1 = dark
+           'runs': Flat list [row, column, length, ...] of horizontal runs of modules that changed since the previous step
+    The first step always uses 'bits', later steps use whichever of the two is smaller.
     """
     steps = []
+    previous = None
+    for snapshot, description in _qr_step_snapshots(ver, ecl, content):
+        step = {'description': description}
+        bits = _matrix_to_bitset(snapshot)
+        if previous is None:
+            step['bits'] = bits
+        else:
+            # Modules that changed are the set bits of the XOR of both steps
+            changed = matrix.BitMatrix(snapshot.size)
+            changed.dark = [a ^ b for a, b in zip(previous.dark, snapshot.dark)]
+            runs = [value for run in draw.dark_runs(changed) for value in run]
+            # A run takes about 3 numbers of 3-4 characters in JSON, a bitset 4 characters per 3 bytes
+            if len(runs) * 4 < len(bits):
+                step['runs'] = runs
+            else:
+                step['bits'] = bits
+        steps.append(step)
+        previous = snapshot
+    return {'size': previous.size, 'steps': steps}
+
+def _matrix_to_bitset(qrmatrix):
+    """
+    Pack the dark modules of a BitMatrix into one bitset, row by row
+    return: Base64 string, the last byte is padded with 0
+    """
+    buffer = BitBuffer()
+    for row in qrmatrix.dark:
+        buffer.append(row, qrmatrix.size)
+    return base64.b64encode(buffer.to_bytes()).decode('ascii')
+
+def _qr_step_snapshots(ver, ecl, content):
+    """
+    Build the QR code once and keep a snapshot of each construction stage
+    ver, ecl, content: Same as get_qr_steps
+    return: List of (matrix snapshot, step description), one per step
+    """
+    # Snapshots of the construction stages, taken during the same single pass that builds the QR code
+    snapshots = {}
     
-    try:
-        # Data encoding - identical to the final QR code generation process
-        ver, data_codewords = data.encode(ver, ecl, content)
-        
-        # Error correction encoding
-        ecc = ECC.encode(ver, ecl, data_codewords)
-        
-        # Structure final data
-        final_bits = structure.structure_final_bits(ver, ecl, data_codewords, ecc)
-        
+    def observe(stage, snapshot, **info):
+        snapshots[stage] = (snapshot, info)
+    
+    make_qrmatrix(ver, ecl, content, observer=observe)
+    mask_num = snapshots['mask'][1]['mask_num']
+    
+    descriptions = (
         # Step 1: Add Finder and Separator
-        qrmatrix_step1 = matrix.initialize_qrmatrix(ver)  # Initialize matrix
-        matrix.add_finder_and_separator(qrmatrix_step1)  # Add finder patterns and separators
-        steps.append({
-            'image': _matrix_to_base64(qrmatrix_step1),  # Convert matrix to Base64 image
-            'description': '<h3>Step 1: Add Finder Patterns and Separator</h3><p>Finder patterns are added to the three corners of the QR code with separators. These patterns help scanners determine the orientation and size of the QR code.</p>'
-        })
-        
+        ('finder', '<h3>Step 1: Add Finder Patterns and Separator</h3><p>Finder patterns are added to the three corners of the QR code with separators. These patterns help scanners determine the orientation and size of the QR code.</p>'),
         # Step 2: Add alignment, Timing patterns and dark module
-        qrmatrix_step2 = [row[:] for row in qrmatrix_step1]
-        matrix.add_alignment(ver, qrmatrix_step2)  # Add alignment patterns (version 2+)
-        matrix.add_timing(qrmatrix_step2)  # Add timing patterns
-        matrix.add_dark_and_reserving(ver, qrmatrix_step2)  # Add dark module and reserved areas
-        steps.append({
-            'image': _matrix_to_base64(qrmatrix_step2),
-            'description': '<h3>Step 2: Add Alignment, Timing Patterns and Dark Module</h3><p>Alignment patterns (version 2+), timing patterns, and the dark module are added. These help with orientation, module positioning, and version identification.</p>'
-        })
-        
+        ('function', '<h3>Step 2: Add Alignment, Timing Patterns and Dark Module</h3><p>Alignment patterns (version 2+), timing patterns, and the dark module are added. These help with orientation, module positioning, and version identification.</p>'),
         # Step 3: Fill data (encoded data + error correction codes)
-        qrmatrix_step3 = [row[:] for row in qrmatrix_step2]
-        # Don't pre-fill None as 0, matrix.place_bits will handle None
-        matrix.place_bits(final_bits, qrmatrix_step3)  # Place data bits into matrix
-        steps.append({
-            'image': _matrix_to_base64(qrmatrix_step3),
-            'description': f'<h3>Step 3: Fill Data</h3><p>Encoded data and error correction codewords are placed into the matrix, avoiding functional patterns.</p>'
-        })
-        
+        ('data', f'<h3>Step 3: Fill Data</h3><p>Encoded data and error correction codewords are placed into the matrix, avoiding functional patterns.</p>'),
         # Step 4: Apply best mask
-        # maskmatrix_base is used to generate mask patterns, should be the matrix state at step 2 (containing functional areas, data areas are None or defined as 0)
-        maskmatrix_base = [row[:] for row in qrmatrix_step2]  # Copy step 2 matrix for mask base
-        # qrmatrix_step3 is the matrix with data already filled, mask will be applied to this matrix
-        mask_num, masked_matrix = matrix.mask(maskmatrix_base, qrmatrix_step3)  # Apply best mask
-        steps.append({
-            'image': _matrix_to_base64(masked_matrix),
-            'description': f'<h3>Step 4: Apply Best Mask (Pattern {mask_num})</h3><p>One of 8 mask patterns is applied to the data area to improve scannability. The pattern ({mask_num}) with the best score is chosen.</p>'
-        })
-        
+        ('mask', f'<h3>Step 4: Apply Best Mask (Pattern {mask_num})</h3><p>One of 8 mask patterns is applied to the data area to improve scannability. The pattern ({mask_num}) with the best score is chosen.</p>'),
         # Step 5: Add format and version information
-        final_matrix = [row[:] for row in masked_matrix]  # Deep copy of step 4 matrix
-        matrix.add_format_and_version_string(ver, ecl, mask_num, final_matrix)  # Add format and version information
-        steps.append({
-            'image': _matrix_to_base64(final_matrix),
-            'description': '<h3>Step 5: Add Format and Version Information</h3><p>Format information (error correction level, mask pattern) and version information (version 7+) are added to complete the QR code.</p>'
-        })
-            
-    except Exception as e:
-        print(f"Error in QR steps generation: {e}")  # Print error message
-        # Error handling: If error occurs during step generation, use fallback
-        try:
-            # Try to generate complete QR code directly as fallback for all steps
-            ver, data_codewords = data.encode(ver, ecl, content)
-            ecc = ECC.encode(ver, ecl, data_codewords)
-            final_bits = structure.structure_final_bits(ver, ecl, data_codewords, ecc)
-            final_qrcode_fallback = matrix.get_qrmatrix(ver, ecl, final_bits)
-            fallback_image = _matrix_to_base64(final_qrcode_fallback)
-            
-            # Use generated complete QR code as image for all steps
-            steps = [
-                {'image': fallback_image, 'description': '<h3>Step 1: Add Finder Patterns and Separator (Error Fallback)</h3><p>Error during step generation. Displaying final QR code.</p>'},
-                {'image': fallback_image, 'description': '<h3>Step 2: Add Alignment, Timing Patterns and Dark Module (Error Fallback)</h3><p>Error during step generation. Displaying final QR code.</p>'},
-                {'image': fallback_image, 'description': '<h3>Step 3: Fill Data (Error Fallback)</h3><p>Error during step generation. Displaying final QR code.</p>'},
-                {'image': fallback_image, 'description': '<h3>Step 4: Apply Best Mask (Error Fallback)</h3><p>Error during step generation. Displaying final QR code.</p>'},
-                {'image': fallback_image, 'description': '<h3>Step 5: Add Format and Version Information (Error Fallback)</h3><p>Error during step generation. Displaying final QR code.</p>'}
-            ]
-        except Exception as e2:
-            print(f"Error in fallback QR steps generation: {e2}")  # Print fallback error message
-            return []  # If all attempts fail, return empty list
-    
-    return steps  # Return generated steps list
+        ('final', '<h3>Step 5: Add Format and Version Information</h3><p>Format information (error correction level, mask pattern) and version information (version 7+) are added to complete the QR code.</p>')
+    )
+    
+    return [(snapshots[stage][0], description) for stage, description in descriptions]
\ No newline at end of file
@@ -0,0 +1,263 @@
+# QR Code Vector Output Module: Streams the QR matrix as SVG or PDF, the document size does not depend on the print size
+
+import zlib
+from draw import dark_runs
+from lazyimport import lazy_module
+
+# For color parsing, PIL is imported on first use
+ImageColor = lazy_module('PIL.ImageColor')
+
+# Supported vector formats: {format: (MIME type, file extension)}
+formats = {
+    'svg': ('image/svg+xml', 'svg'),
+    'pdf': ('application/pdf', 'pdf')
+}
+
+# Control point distance of a quarter circle Bezier curve, as a fraction of the radius
+KAPPA = 0.5522847498
+
+def vector_qrcode(qrmatrix, format='svg', **kwargs):
+    """
+    Stream the QR code as a vector document
+    
+    Parameters:
+    qrmatrix: QR matrix
+    format: 'svg' or 'pdf'
+    kwargs: Custom parameters, see svg_qrcode
+    
+    return: Generator of bytes chunks, the document is produced row by row while it is being sent
+    """
+    if format == 'svg':
+        return svg_qrcode(qrmatrix, **kwargs)
+    if format == 'pdf':
+        return pdf_qrcode(qrmatrix, **kwargs)
+    raise ValueError(f'Unsupported vector format: {format}')
+
+def svg_qrcode(qrmatrix, **kwargs):
+    """
+    Stream the QR code as an SVG document
+    One module is one user unit of the viewBox, horizontal runs of dark square modules are merged into one subpath
+    
+    Parameters:
+    qrmatrix: QR matrix
+    
+    Custom parameters (same as draw.render_qrcode, filter_name is ignored):
+    background_color: Background color, default white
+    foreground_color: Foreground color, default black
+    module_shape: Module shape, options 'square', 'circle', 'diamond'
+    border_size: Width of the frame in pixels, default 4
+    unit_size: Nominal size of each module in pixels (sets width/height only, the drawing scales freely), default 3
+    frame: Whether to add a frame, default True
+    margin: Margin size, default 4 units
+    
+    return: Generator of bytes chunks, invalid parameters raise ValueError before anything is generated
+    """
+    return _svg_chunks(qrmatrix, _layout(qrmatrix, kwargs))
+
+def _svg_chunks(qrmatrix, layout):
+    """
+    Generate the SVG document for svg_qrcode
+    """
+    total = layout['total']
+    size = _num(total * layout['unit_size'])
+    
+    yield (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<svg xmlns="http://www.w3.org/2000/svg" version="1.1" width="{size}" height="{size}" viewBox="0 0 {total} {total}">\n'
+        f'<rect width="{total}" height="{total}" fill="{_hex(layout["background"])}"/>\n'
+    ).encode()
+    
+    # All dark modules form one path, written one matrix row at a time
+    rendering = ' shape-rendering="crispEdges"' if layout['module_shape'] == 'square' else ''
+    yield f'<path fill="{_hex(layout["foreground"])}"{rendering} d="'.encode()
+    for row in _rows(qrmatrix, layout['margin']):
+        yield (''.join(_svg_subpath(layout['module_shape'], y, x, length) for y, x, length in row) + '\n').encode()
+    yield b'"/>\n'
+    
+    # Frame: outer square minus inner square
+    width = layout['frame_width']
+    if width:
+        inner = _num(total - 2 * width)
+        yield (
+            f'<path fill="{_hex(layout["foreground"])}" fill-rule="evenodd" '
+            f'd="M0 0h{total}v{total}h-{total}z M{_num(width)} {_num(width)}v{inner}h{inner}v-{inner}z"/>\n'
+        ).encode()
+    
+    yield b'</svg>\n'
+
+def pdf_qrcode(qrmatrix, **kwargs):
+    """
+    Stream the QR code as a single page PDF document
+    One module is one unit of the page content, scaled to unit_size points, the content stream is compressed as it is written
+    
+    Parameters:
+    qrmatrix: QR matrix
+    kwargs: Custom parameters, see svg_qrcode (unit_size is in points)
+    
+    return: Generator of bytes chunks, invalid parameters raise ValueError before anything is generated
+    """
+    return _pdf_chunks(qrmatrix, _layout(qrmatrix, kwargs))
+
+def _pdf_chunks(qrmatrix, layout):
+    """
+    Generate the PDF document for pdf_qrcode
+    """
+    total = layout['total']
+    scale = layout['unit_size']
+    page = _num(total * scale)
+    
+    # Byte offset of every object for the cross-reference table
+    offsets = []
+    position = 0
+    
+    def write(chunk, start_object=False):
+        nonlocal position
+        if start_object:
+            offsets.append(position)
+        position += len(chunk)
+        return chunk
+    
+    yield write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    yield write(b'1 0 obj\n<< /Type /Catalog /Pages 2 0 R >>\nendobj\n', True)
+    yield write(b'2 0 obj\n<< /Type /Pages /Kids [3 0 R] /Count 1 >>\nendobj\n', True)
+    yield write(
+        f'3 0 obj\n<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page} {page}] /Contents 4 0 R /Resources << >> >>\nendobj\n'.encode(),
+        True
+    )
+    # The length of the compressed content is only known at the end, it is written as object 5
+    yield write(b'4 0 obj\n<< /Length 5 0 R /Filter /FlateDecode >>\nstream\n', True)
+    
+    compressor = zlib.compressobj(9)
+    stream_length = 0
+    
+    def content(text):
+        nonlocal stream_length
+        chunk = compressor.compress(text.encode())
+        stream_length += len(chunk)
+        return chunk
+    
+    # Flip the y axis so that module coordinates run top to bottom like in the matrix
+    yield write(content(
+        f'q\n{_num(scale)} 0 0 {_num(-scale)} 0 {page} cm\n'
+        f'{_pdf_color(layout["background"])} rg\n0 0 {total} {total} re f\n'
+        f'{_pdf_color(layout["foreground"])} rg\n'
+    ))
+    for row in _rows(qrmatrix, layout['margin']):
+        yield write(content(''.join(_pdf_subpath(layout['module_shape'], y, x, length) for y, x, length in row)))
+    
+    # Fill all dark modules at once, then the frame
+    tail = 'f\n'
+    width = layout['frame_width']
+    if width:
+        inner = _num(total - 2 * width)
+        tail += f'0 0 {total} {total} re {_num(width)} {_num(width)} {inner} {inner} re f*\n'
+    yield write(content(tail + 'Q\n'))
+    rest = compressor.flush()
+    stream_length += len(rest)
+    yield write(rest)
+    yield write(b'\nendstream\nendobj\n')
+    yield write(f'5 0 obj\n{stream_length}\nendobj\n'.encode(), True)
+    
+    # Cross-reference table and trailer
+    xref = position
+    table = ''.join(f'{offset:010d} 00000 n \n' for offset in offsets)
+    yield write((
+        f'xref\n0 {len(offsets) + 1}\n0000000000 65535 f \n{table}'
+        f'trailer\n<< /Size {len(offsets) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n'
+    ).encode())
+
+def _layout(qrmatrix, kwargs):
+    """
+    Read the custom parameters and calculate the document size in modules
+    return: Dict of the parameters, colors as RGB tuples, 'total' (size in modules) and 'frame_width' (in modules)
+    """
+    unit_size = kwargs.get('unit_size', 3)
+    margin = kwargs.get('margin', 4)
+    border_size = kwargs.get('border_size', 4)
+    frame = kwargs.get('frame', True)
+    
+    # Colors are normalized to RGB, which also keeps user input out of the document markup
+    return {
+        'foreground': ImageColor.getrgb(kwargs.get('foreground_color', 'black'))[:3],
+        'background': ImageColor.getrgb(kwargs.get('background_color', 'white'))[:3],
+        'module_shape': kwargs.get('module_shape', 'square'),
+        'unit_size': unit_size,
+        'margin': margin,
+        'total': len(qrmatrix) + 2 * margin,
+        # The raster frame is border_size pixels wide, keep the same share of the image
+        'frame_width': border_size / unit_size if frame and border_size > 0 else 0
+    }
+
+def _rows(qrmatrix, margin):
+    """
+    Group the dark runs of the matrix by row, shifted by the margin
+    return: Generator of lists of (y, x, length), one list per row that has dark modules
+    """
+    row = []
+    current = None
+    for y, x, length in dark_runs(qrmatrix):
+        if y != current and row:
+            yield row
+            row = []
+        current = y
+        row.append((y + margin, x + margin, length))
+    if row:
+        yield row
+
+def _svg_subpath(shape, y, x, length):
+    """
+    SVG path data of a run of dark modules: one rectangle for squares, one subpath per module otherwise
+    """
+    if shape == 'circle':
+        return ''.join(f'M{x + i} {y}.5a.5 .5 0 1 0 1 0a.5 .5 0 1 0-1 0z' for i in range(length))
+    if shape == 'diamond':
+        return ''.join(f'M{x + i}.5 {y}l.5 .5-.5 .5-.5-.5z' for i in range(length))
+    return f'M{x} {y}h{length}v1h-{length}z'
+
+def _pdf_subpath(shape, y, x, length):
+    """
+    PDF path operators of a run of dark modules: one rectangle for squares, one subpath per module otherwise
+    """
+    if shape == 'circle':
+        # Four Bezier curves, counterclockwise from the rightmost point
+        k = 0.5 * KAPPA
+        parts = []
+        for left in range(x, x + length):
+            right, top, bottom = left + 1, y, y + 1
+            cx, cy = left + 0.5, y + 0.5
+            parts.append(
+                f'{_nums(right, cy)} m {_nums(right, cy + k, cx + k, bottom, cx, bottom)} c '
+                f'{_nums(cx - k, bottom, left, cy + k, left, cy)} c {_nums(left, cy - k, cx - k, top, cx, top)} c '
+                f'{_nums(cx + k, top, right, cy - k, right, cy)} c\n'
+            )
+        return ''.join(parts)
+    if shape == 'diamond':
+        return ''.join(
+            f'{x + i}.5 {y} m {x + i + 1} {y}.5 l {x + i}.5 {y + 1} l {x + i} {y}.5 l h\n' for i in range(length)
+        )
+    return f'{x} {y} {length} 1 re\n'
+
+def _num(value):
+    """
+    Format a coordinate with at most 4 decimals and without trailing zeros
+    """
+    text = f'{value:.4f}'.rstrip('0').rstrip('.')
+    return text if text != '-0' else '0'
+
+def _nums(*values):
+    """
+    Format several coordinates separated by spaces
+    """
+    return ' '.join(_num(value) for value in values)
+
+def _hex(rgb):
+    """
+    Format an RGB tuple as an SVG color
+    """
+    return '#{:02x}{:02x}{:02x}'.format(*rgb)
+
+def _pdf_color(rgb):
+    """
+    Format an RGB tuple as PDF color components (0-1)
+    """
+    return ' '.join(_num(c / 255) for c in rgb)
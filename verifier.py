@@ -0,0 +1,455 @@
+# QR Code Verifier Module: Decodes a generated QR matrix or rendered image back to its content to prove the round trip
+
+import io
+import os
+import random
+import ECC, matrix, data
+from data import get_cci_len
+from constant import format_info_str, version_info_str, lindex, grouping_list, ecc_num_per_block, alphanum_list, po2, log
+from constant import structured_append_indicator
+from lazyimport import lazy_module
+
+# For reading images, PIL is imported on first use
+Image = lazy_module('PIL.Image')
+ImageColor = lazy_module('PIL.ImageColor')
+
+# Fraction of batch items whose rendered image is decoded and compared with the input (0 disables verification)
+VERIFY_SAMPLE_RATE = float(os.environ.get('QR_VERIFY_SAMPLE_RATE', '0'))
+
+# Data module order and mask planes per version, built on first use: {ver: (data order, 8 mask planes)}
+_layout_cache = {}
+
+# Encoding modes by mode indicator
+_modes = {0b0001: 'numeric', 0b0010: 'alphanumeric', 0b0100: 'byte', 0b1000: 'kanji'}
+
+class VerificationError(ValueError):
+    """
+    A QR code could not be decoded, or it decodes to something else than its input
+    """
+
+def verify(qrmatrix, content, ver=None, ecl=None, structured_append=None):
+    """
+    Decode a QR matrix and check that it holds the expected content
+    qrmatrix: QR matrix (matrix.BitMatrix or list matrix)
+    content: String the QR code was generated from
+    ver, ecl: Expected version and error correction level, None to accept any
+    structured_append: Expected (symbol position, number of symbols, parity) of a Structured Append symbol, None to accept any
+    return: Decoding result, see decode
+    """
+    return _check(decode(qrmatrix), content, ver, ecl, structured_append)
+
+def verify_image(image, content, ver=None, ecl=None, structured_append=None, **kwargs):
+    """
+    Read a rendered QR code image and check that it holds the expected content
+    image: PIL image, PNG file content (bytes) or path of an image written by draw.draw_qrcode
+    content, ver, ecl, structured_append: See verify
+    kwargs: Custom parameters the image was drawn with, see read_image
+    return: Decoding result, see decode
+    """
+    return _check(decode(read_image(image, **kwargs)), content, ver, ecl, structured_append)
+
+def verify_set(qrmatrices, content, ver=None, ecl=None):
+    """
+    Decode the symbols of a Structured Append set and check that together they hold the expected content
+    qrmatrices: QR matrices of the set, in any order
+    content, ver, ecl: See verify
+    return: List of decoding results in symbol order, see decode
+    """
+    results = [decode(m) for m in qrmatrices]
+    headers = [r['structured_append'] for r in results]
+    if None in headers:
+        raise VerificationError('A symbol of the set has no Structured Append header')
+    
+    # Every symbol must agree on the number of symbols and the parity, and each position must appear once
+    results.sort(key=lambda r: r['structured_append'][0])
+    total, parity = headers[0][1], headers[0][2]
+    if any(h[1:] != (total, parity) for h in headers) or [h[0] for h in sorted(headers)] != list(range(total)):
+        raise VerificationError(f'The symbols do not form a complete set of {total}')
+    joined = ''.join(r['content'] for r in results)
+    if data.parity(joined) != parity:
+        raise VerificationError('Structured Append parity does not match the decoded content')
+    for r in results:
+        _check(r, r['content'], ver, ecl)
+    if joined != content:
+        raise VerificationError('Decoded content does not match the input')
+    return results
+
+def should_verify(rate=None):
+    """
+    Decide whether one item of a batch is verified
+    rate: Fraction of the items to verify, default QR_VERIFY_SAMPLE_RATE
+    return: True for a random sample of the calls
+    """
+    rate = VERIFY_SAMPLE_RATE if rate is None else rate
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+def decode(qrmatrix):
+    """
+    Decode a QR matrix: format and version information, unmasking, de-interleaving,
+    Reed-Solomon error correction and the data segments
+    qrmatrix: QR matrix (matrix.BitMatrix or list matrix)
+    return: Dict with 'version', 'ecl', 'mask_num', 'content', 'structured_append'
+            ((symbol position, number of symbols, parity) of a Structured Append symbol, else None)
+            and 'corrected' (number of codewords Reed-Solomon had to correct, 0 for an undamaged code)
+    """
+    m = _to_bitmatrix(qrmatrix)
+    ver = (m.size - 17) // 4
+    if m.size != ver * 4 + 17 or not 1 <= ver <= 40:
+        raise VerificationError(f'{m.size} modules per side is not a QR code size')
+    
+    # Format information: error correction level and mask pattern
+    ecl, mask_num = read_format(m)
+    
+    # Version information of versions 7 and above must agree with the size
+    if ver > 6:
+        info_ver = read_version(m)
+        if info_ver != ver:
+            raise VerificationError(f'Version information {info_ver} does not match the size of version {ver}')
+    
+    # Unmask the data modules and read them in placement order
+    order, planes = get_layout(ver)
+    dark = [row ^ plane for row, plane in zip(m.dark, planes[mask_num])]
+    value = 0
+    for i, b in order:
+        value = (value << 1) | (1 if dark[i] & b else 0)
+    
+    # Drop the remainder bits, the rest are whole codewords
+    g = grouping_list[ver-1][lindex[ecl]]
+    ecc_num = ecc_num_per_block[ver-1][lindex[ecl]]
+    total = g[0] * g[1] + g[2] * g[3] + (g[0] + g[2]) * ecc_num
+    codewords = (value >> (len(order) - 8 * total)).to_bytes(total, 'big')
+    
+    # Correct each block, then join the data codewords in block order
+    # An undamaged block ends with the error correction codewords of its data, only other blocks are decoded
+    blocks = deinterleave(ver, ecl, codewords)
+    expected = ECC.encode(ver, ecl, [block[:data_len] for block, data_len in blocks])
+    corrected = 0
+    data_code = []
+    for (block, data_len), ecc in zip(blocks, expected):
+        if block[data_len:] != ecc:
+            block, errors = rs_correct(block, ecc_num)
+            corrected += errors
+        data_code += block[:data_len]
+    
+    content, structured_append = read_segments(ver, bytes(data_code))
+    return {
+        'version': ver,
+        'ecl': ecl,
+        'mask_num': mask_num,
+        'content': content,
+        'structured_append': structured_append,
+        'corrected': corrected
+    }
+
+def read_image(image, **kwargs):
+    """
+    Read the modules of a rendered QR code image by sampling the center pixel of every module
+    image: PIL image, PNG file content (bytes) or path of an image written by draw.draw_qrcode
+    
+    Custom parameters (the ones the image was drawn with, same defaults as draw.render_qrcode):
+    background_color: Background color, default white
+    foreground_color: Foreground color, default black
+    unit_size: Size of each module in pixels, at least 2, default 3
+    margin: Margin size, default 4 units
+    
+    return: QR matrix (matrix.BitMatrix)
+    """
+    if isinstance(image, (bytes, bytearray)):
+        image = Image.open(io.BytesIO(image))
+    elif not isinstance(image, Image.Image):
+        image = Image.open(image)
+    unit_size = kwargs.get('unit_size', 3)
+    margin = kwargs.get('margin', 4)
+    foreground = ImageColor.getrgb(kwargs.get('foreground_color', 'black'))[:3]
+    background = ImageColor.getrgb(kwargs.get('background_color', 'white'))[:3]
+    
+    # A dark square module covers unit_size + 1 pixels, with one pixel per module its neighbor would hide it
+    if unit_size < 2:
+        raise ValueError('Images with a unit size below 2 pixels cannot be read back')
+    size = image.width // unit_size - 2 * margin
+    if image.width != image.height or size < 21:
+        raise VerificationError(f'A {image.width}x{image.height} image does not hold a QR code with these parameters')
+    
+    # Module centers, then each sampled pixel is dark when it is closer to the foreground color
+    origin = margin * unit_size + unit_size // 2
+    centers = [origin + i * unit_size for i in range(size)]
+    pixels = image.convert('RGB').tobytes()
+    stride = 3 * image.width
+    m = matrix.BitMatrix(size)
+    for r, y in enumerate(centers):
+        row = 0
+        for x in centers:
+            p = y * stride + 3 * x
+            rgb = pixels[p:p+3]
+            closer = sum((c - f) ** 2 for c, f in zip(rgb, foreground)) < sum((c - b) ** 2 for c, b in zip(rgb, background))
+            row = (row << 1) | closer
+        m.dark[r] = row
+    m.filled = True
+    return m
+
+def read_format(m):
+    """
+    Read the format information of a QR matrix, the copy with the fewest bit errors is used
+    m: QR matrix (matrix.BitMatrix)
+    return: (Error correction level, mask pattern)
+    """
+    # Same module positions as matrix.add_format_and_version_string, bit 0 first
+    get = lambda r, c: m.get(r % m.size, c % m.size)
+    first = [get(8, j) for j in range(6)] + [get(8, 7), get(8, 8), get(7, 8)] + [get(j, 8) for j in range(5, -1, -1)]
+    second = [get(-j-1, 8) for j in range(6)] + [get(-7, 8), get(8, -8), get(8, -7)] + [get(8, -j-1) for j in range(5, -1, -1)]
+    
+    best = None
+    for ecl, level in lindex.items():
+        for mask_num, fs in enumerate(format_info_str[level]):
+            distance = min(_distance(fs, first), _distance(fs, second))
+            if best is None or distance < best[0]:
+                best = (distance, ecl, mask_num)
+    
+    # The format BCH code corrects up to 3 bit errors
+    if best[0] > 3:
+        raise VerificationError('Format information is unreadable')
+    return best[1], best[2]
+
+def read_version(m):
+    """
+    Read the version information of a QR matrix (versions 7 and above), the copy with the fewest bit errors is used
+    m: QR matrix (matrix.BitMatrix)
+    return: Version
+    """
+    # Same module order as matrix.add_format_and_version_string
+    positions = [(i, j) for j in range(5, -1, -1) for i in (-9, -10, -11)]
+    below = [m.get(i % m.size, j) for i, j in positions]
+    right = [m.get(j, i % m.size) for i, j in positions]
+    
+    distance, ver = min((min(_distance(vs, below), _distance(vs, right)), i + 7) for i, vs in enumerate(version_info_str))
+    
+    # The version BCH code corrects up to 3 bit errors
+    if distance > 3:
+        raise VerificationError('Version information is unreadable')
+    return ver
+
+def get_layout(ver):
+    """
+    Get the data module order and the mask planes of a version, computed once and cached
+    ver: QR code version (1-40)
+    return: (Tuple of (row, column bit) pairs, 8 tuples of row ints)
+    """
+    if ver not in _layout_cache:
+        template = matrix.get_template(ver)
+        _layout_cache[ver] = (matrix.get_data_order(template), matrix.get_mask_planes(template))
+    return _layout_cache[ver]
+
+def deinterleave(ver, ecl, codewords):
+    """
+    Undo structure.structure_final_bits: split the interleaved codewords into blocks
+    ver: QR code version (1-40)
+    ecl: Error correction level (L/M/Q/H)
+    codewords: All codewords of the symbol
+    return: List of (block codewords, number of data codewords in the block)
+    """
+    g = grouping_list[ver-1][lindex[ecl]]
+    ecc_num = ecc_num_per_block[ver-1][lindex[ecl]]
+    lengths = [g[1]] * g[0] + [g[3]] * g[2]
+    blocks = [[] for _ in lengths]
+    
+    # Data codewords are taken one per block in turn, short blocks drop out after their last codeword
+    i = 0
+    for n in range(max(lengths)):
+        for block, length in zip(blocks, lengths):
+            if n < length:
+                block.append(codewords[i])
+                i += 1
+    
+    # Error correction codewords, all blocks have the same number
+    for n in range(ecc_num):
+        for block in blocks:
+            block.append(codewords[i])
+            i += 1
+    
+    return list(zip(blocks, lengths))
+
+def rs_correct(block, ecc_num):
+    """
+    Reed-Solomon decoding of one block, with the generator polynomial of ECC.get_generator (roots α^0..α^(ecc_num-1))
+    block: Data codewords followed by error correction codewords
+    ecc_num: Number of error correction codewords
+    return: (Corrected block, number of corrected codewords)
+    """
+    n = len(block)
+    
+    # Syndromes: the block polynomial evaluated at the generator roots, all zero when there is no error
+    syndromes = [_poly_eval(block, po2[i]) for i in range(ecc_num)]
+    if not any(syndromes):
+        return list(block), 0
+    
+    # Berlekamp-Massey: error locator polynomial, lowest degree term first
+    locator, previous = [1], [1]
+    errors, shift, last = 0, 1, 1
+    for k in range(ecc_num):
+        delta = syndromes[k]
+        for i in range(1, min(errors, len(locator) - 1) + 1):
+            delta ^= _mul(locator[i], syndromes[k-i])
+        if delta == 0:
+            shift += 1
+            continue
+        factor = _div(delta, last)
+        update = locator + [0] * max(0, len(previous) + shift - len(locator))
+        for i, p in enumerate(previous):
+            update[i + shift] ^= _mul(factor, p)
+        if 2 * errors <= k:
+            previous, last = locator, delta
+            errors = k + 1 - errors
+            shift = 1
+        else:
+            shift += 1
+        locator = update
+    if 2 * errors > ecc_num:
+        raise VerificationError('Too many errors to correct')
+    
+    # Chien search: codeword j (term x^(n-1-j)) is wrong where the locator has a root at α^-(n-1-j)
+    positions = [j for j in range(n) if _poly_eval(locator[::-1], po2[(255 - (n - 1 - j)) % 255]) == 0]
+    if len(positions) != errors:
+        raise VerificationError('Too many errors to correct')
+    
+    # Forney: error values from the evaluator polynomial and the derivative of the locator
+    evaluator = [0] * ecc_num
+    for i, s in enumerate(syndromes):
+        for j, l in enumerate(locator[:ecc_num - i]):
+            evaluator[i + j] ^= _mul(s, l)
+    derivative = [l if i % 2 else 0 for i, l in enumerate(locator)][1:]
+    corrected = list(block)
+    for j in positions:
+        x = po2[(n - 1 - j) % 255]
+        x_inv = po2[(255 - (n - 1 - j)) % 255]
+        denominator = _poly_eval(derivative[::-1], x_inv)
+        if denominator == 0:
+            raise VerificationError('Too many errors to correct')
+        corrected[j] ^= _mul(x, _div(_poly_eval(evaluator[::-1], x_inv), denominator))
+    
+    if any(_poly_eval(corrected, po2[i]) for i in range(ecc_num)):
+        raise VerificationError('Too many errors to correct')
+    return corrected, errors
+
+def read_segments(ver, data_code):
+    """
+    Decode the segments of the data codewords, the reverse of data.encode
+    ver: QR code version (1-40)
+    data_code: Data codewords (bytes)
+    return: (Content string, (symbol position, number of symbols, parity) of a Structured Append header or None)
+    """
+    reader = _BitReader(data_code)
+    parts = []
+    structured_append = None
+    while reader.remaining() >= 4:
+        indicator = reader.read(4)
+        if indicator == 0:
+            break  # Terminator
+        if indicator == structured_append_indicator and not parts and structured_append is None:
+            # Header of a Structured Append symbol, only before the first segment
+            position, total = reader.read(4), reader.read(4) + 1
+            structured_append = (position, total, reader.read(8))
+            continue
+        mode = _modes.get(indicator)
+        if mode is None:
+            raise VerificationError(f'Unsupported mode indicator {indicator:04b}')
+        count = reader.read(get_cci_len(ver, mode))
+    
+        if mode == 'numeric':
+            digits = []
+            for size in [3] * (count // 3) + ([count % 3] if count % 3 else []):
+                digits.append(str(reader.read((0, 4, 7, 10)[size])).zfill(size))
+            parts.append(''.join(digits))
+        elif mode == 'alphanumeric':
+            chars = []
+            for _ in range(count // 2):
+                value = reader.read(11)
+                chars.append(alphanum_list[value // 45] + alphanum_list[value % 45])
+            if count % 2:
+                chars.append(alphanum_list[reader.read(6)])
+            parts.append(''.join(chars))
+        elif mode == 'byte':
+            parts.append(bytes(reader.read(8) for _ in range(count)).decode('iso-8859-1'))
+        else:
+            chars = []
+            for _ in range(count):
+                # Undo data.kanji_value: two byte offset from 0x8140 or 0xC140
+                value = reader.read(13)
+                code = (value // 0xC0 << 8) | (value % 0xC0)
+                code += 0x8140 if code < 0x1F00 else 0xC140
+                chars.append(code.to_bytes(2, 'big').decode('shift_jis'))
+            parts.append(''.join(chars))
+    
+    return ''.join(parts), structured_append
+
+class _BitReader:
+    """
+    Reads big-endian bit fields from bytes, past the end the reader raises VerificationError
+    """
+    def __init__(self, data):
+        self.value = int.from_bytes(data, 'big')
+        self.length = 8 * len(data)
+        self.position = 0
+    
+    def remaining(self):
+        return self.length - self.position
+    
+    def read(self, n):
+        if n > self.remaining():
+            raise VerificationError('Data segment runs past the end of the data codewords')
+        self.position += n
+        return (self.value >> (self.length - self.position)) & ((1 << n) - 1)
+
+def _check(result, content, ver, ecl, structured_append=None):
+    """
+    Compare a decoding result with the expected content, version, error correction level and Structured Append header
+    return: result
+    """
+    if result['corrected']:
+        raise VerificationError(f"{result['corrected']} codewords needed error correction")
+    if ver is not None and result['version'] != ver:
+        raise VerificationError(f"Decoded version {result['version']}, expected {ver}")
+    if ecl is not None and result['ecl'] != ecl:
+        raise VerificationError(f"Decoded error correction level {result['ecl']}, expected {ecl}")
+    if structured_append is not None and result['structured_append'] != tuple(structured_append):
+        raise VerificationError(f"Decoded Structured Append header {result['structured_append']}, expected {tuple(structured_append)}")
+    if result['content'] != content:
+        raise VerificationError('Decoded content does not match the input')
+    return result
+
+def _to_bitmatrix(qrmatrix):
+    """
+    Get a BitMatrix of a QR matrix, a list matrix is converted
+    """
+    if isinstance(qrmatrix, matrix.BitMatrix):
+        return qrmatrix
+    m = matrix.BitMatrix(len(qrmatrix))
+    for r, row in enumerate(qrmatrix):
+        for cell in row:
+            m.dark[r] = (m.dark[r] << 1) | (1 if cell else 0)
+    m.filled = True
+    return m
+
+def _distance(bits, modules):
+    """
+    Number of modules that differ from a '0'/'1' string
+    """
+    return sum(int(b) != (1 if v else 0) for b, v in zip(bits, modules))
+
+def _poly_eval(poly, x):
+    """
+    Evaluate a polynomial over GF(256), highest degree term first
+    """
+    y = 0
+    for c in poly:
+        y = _mul(y, x) ^ c
+    return y
+
+def _mul(a, b):
+    if a == 0 or b == 0:
+        return 0
+    return po2[(log[a] + log[b]) % 255]
+
+def _div(a, b):
+    if a == 0:
+        return 0
+    return po2[(log[a] - log[b]) % 255]
@@ -0,0 +1,155 @@
+# QR Code Work Queue Module: Bounded executor for CPU-heavy generation, full queues fail fast instead of piling up
+
+import asyncio
+import os
+import threading
+import metrics
+import concurrent.futures  # Worker processes are only loaded when the first job needs them
+from concurrent.futures import Future
+
+class QueueFull(Exception):
+    """
+    The work queue has no room for another job (or is shutting down), the client should retry later
+    retry_after: Suggested number of seconds to wait before retrying
+    """
+    def __init__(self, retry_after):
+        super().__init__('Server is busy, please retry later')
+        self.retry_after = retry_after
+
+class WorkQueue:
+    """
+    Runs generation jobs with a bounded number of pending jobs
+    workers: Number of worker processes, 0 runs jobs in the calling thread (default QR_WORKERS, 0)
+    max_pending: Jobs running or waiting at most, more are rejected with QueueFull
+                 (default QR_MAX_PENDING, 4 per worker, or 8 when jobs run in the calling thread)
+    retry_after: Seconds reported to rejected clients (default QR_RETRY_AFTER, 1)
+    
+    Usage:
+        queue = WorkQueue()
+        queue.run(func, *args)              # Result of func(*args), raises QueueFull when full
+        await queue.run_async(func, *args)  # Same from a coroutine, the event loop is not blocked
+        queue.run(func, *args, wait=True)   # Wait for room instead of failing (batch jobs)
+        queue.shutdown()                    # Reject new jobs, finish the pending ones, stop the workers
+    
+    Functions and arguments must be picklable when worker processes are used.
+    """
+    def __init__(self, workers=None, max_pending=None, retry_after=None):
+        if workers is None:
+            workers = int(os.environ.get('QR_WORKERS', '0'))
+        if max_pending is None:
+            max_pending = int(os.environ.get('QR_MAX_PENDING', workers * 4 or 8))
+        if retry_after is None:
+            retry_after = int(os.environ.get('QR_RETRY_AFTER', '1'))
+        self.workers = workers
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+        self.rejected = 0
+        self._pending = 0
+        self._draining = False
+        self._executor = None  # Worker processes are started on the first job
+        self._lock = threading.Lock()
+        self._room = threading.Condition(self._lock)
+    
+    @property
+    def pending(self):
+        """Number of jobs running or waiting"""
+        return self._pending
+    
+    def submit(self, func, *args, wait=False, **kwargs):
+        """
+        Start a job
+        wait: True to wait for room in the queue instead of raising QueueFull
+        return: concurrent.futures.Future of the result
+        """
+        with self._lock:
+            while not self._draining and self._pending >= self.max_pending and wait:
+                self._room.wait()
+            if self._draining or self._pending >= self.max_pending:
+                self.rejected += 1
+                raise QueueFull(self.retry_after)
+            self._pending += 1
+            if self.workers and self._executor is None:
+                self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+    
+        if not self.workers:
+            # No worker processes: run now in the calling thread, the queue only limits concurrency
+            future = Future()
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            self._finish(future)
+            return future
+    
+        try:
+            future = self._executor.submit(_run_job, func, args, kwargs)
+        except BaseException:
+            self._finish(None)
+            raise
+        future.add_done_callback(self._finish)
+        # Stage metrics recorded in the worker process are added to the metrics of this process
+        unwrapped = Future()
+        future.add_done_callback(lambda done: _unwrap(done, unwrapped))
+        return unwrapped
+    
+    def run(self, func, *args, wait=False, **kwargs):
+        """
+        Run a job and wait for its result
+        return: Result of func(*args, **kwargs), its exceptions are raised here
+        """
+        return self.submit(func, *args, wait=wait, **kwargs).result()
+    
+    async def run_async(self, func, *args, **kwargs):
+        """
+        Run a job from a coroutine without blocking the event loop
+        return: Result of func(*args, **kwargs)
+        """
+        if not self.workers:
+            # Jobs in the calling thread would block the event loop, run them in the default thread pool
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, lambda: self.run(func, *args, **kwargs))
+        return await asyncio.wrap_future(self.submit(func, *args, **kwargs))
+    
+    def shutdown(self, timeout=None):
+        """
+        Graceful shutdown: new jobs are rejected with QueueFull, pending jobs are finished, then the workers stop
+        timeout: Seconds to wait for pending jobs at most, None waits until they are done
+        return: True if all pending jobs finished
+        """
+        with self._lock:
+            self._draining = True
+            self._room.notify_all()
+            done = self._room.wait_for(lambda: self._pending == 0, timeout)
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=done, cancel_futures=not done)
+        return done
+    
+    def _finish(self, future):
+        with self._lock:
+            self._pending -= 1
+            self._room.notify_all()
+
+def _run_job(func, args, kwargs):
+    """
+    Run a job in a worker process
+    return: (result, stage metric observations made by the job)
+    """
+    with metrics.capture() as observations:
+        result = func(*args, **kwargs)
+    return result, observations
+
+def _unwrap(done, future):
+    """
+    Pass the result of a worker process job on, after adding its metric observations to this process
+    """
+    if done.cancelled():
+        future.cancel()
+        return
+    error = done.exception()
+    if error is not None:
+        future.set_exception(error)
+        return
+    result, observations = done.result()
+    metrics.replay(observations)
+    future.set_result(result)